@@ -3,32 +3,76 @@ Online Chat Messenger - Stage 1 Client
 UPD-based chat client for connecting to server.
 """
 
+import multiprocessing
+import queue
+import select
+import signal
 import socket
+import sys
 import threading
 import time
 
 try:
     from .protocol import (
+        INACTIVE_NOTICE,
         MAX_MESSAGE_SIZE,
         MSG_TYPE_CHAT,
         MSG_TYPE_SYSTEM,
+        PONG_PACKET,
+        SHUTDOWN_NOTICE,
         decode_message,
         encode_disconnect_request,
         encode_join_request,
-        encode_message,
         encode_ping_request,
+        make_chat_encoder,
     )
+    from .mmsg import send_all
 except ImportError:
     from protocol import (
+        INACTIVE_NOTICE,
         MAX_MESSAGE_SIZE,
         MSG_TYPE_CHAT,
         MSG_TYPE_SYSTEM,
+        PONG_PACKET,
+        SHUTDOWN_NOTICE,
         decode_message,
         encode_disconnect_request,
         encode_join_request,
-        encode_message,
         encode_ping_request,
+        make_chat_encoder,
     )
+    from mmsg import send_all
+
+PROMPT = "🗣️ "
+_CLEAR_LINE = "\r\x1b[K"  # Carriage return + ANSI erase to end of line
+MAX_SEND_BATCH = 16  # Chat packets coalesced into one sendmmsg call
+
+# The receiver runs in a child process, so recv/decode never contend with the
+# input loop for the GIL. spawn, not fork: the parent already runs threads.
+_RECEIVER_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _receive_worker(sock: socket.socket, inbox, stopping):
+    """Receive and decode datagrams, feeding (username, message, msg_type) to inbox."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is the parent's to handle
+
+    # One reusable buffer: each datagram is decoded before the next recv
+    buffer = memoryview(bytearray(MAX_MESSAGE_SIZE))
+    while True:
+        try:
+            nbytes, _ = sock.recvfrom_into(buffer)
+        except OSError:
+            break
+        if stopping.is_set():
+            break  # Woken by _stop_receiver's shutdown()
+        try:
+            inbox.put(decode_message(buffer[:nbytes]))
+        except ValueError:
+            continue  # Drop malformed datagrams
+
+    # Tell the parent the socket is gone
+    inbox.put(None)
+    sock.close()
 
 
 class ChatClient:
@@ -37,9 +81,21 @@ class ChatClient:
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.username = input("Enter your username: ")
+        # Resolve once: sendmmsg needs a numeric address and sendto skips a lookup
+        self._server_addr = (socket.gethostbyname(host), port)
+
+        # The username never changes, so encode it and the fixed packets once
+        self._encode_chat = make_chat_encoder(self.username)
+        self._join_data = encode_join_request(self.username)
+        self._disconnect_data = encode_disconnect_request(self.username)
+        self._ping_data = encode_ping_request(self.username)
         self.running = False
         self.joined = False
-        self.prompt_shown = False
+        self._receiver = None
+        self._receiver_stopping = None  # Event set by _stop_receiver
+        self._inbox = None
+        self._outbox = queue.SimpleQueue()  # Encoded chat packets for _send_loop
+        self._sender = None
 
     def connect(self):
         """Connect to the chat server."""
@@ -51,10 +107,14 @@ class ChatClient:
 
         self.running = True
 
-        # Start message receiving thread
+        # Start the receiver and the thread that displays what it decodes
+        self._start_receiver()
         receive_thread = threading.Thread(target=self._receive_messages)
         receive_thread.daemon = True
         receive_thread.start()
+        self._sender = threading.Thread(target=self._send_loop)
+        self._sender.daemon = True
+        self._sender.start()
 
         # Show initial prompt
         self._show_prompt()
@@ -87,8 +147,7 @@ class ChatClient:
     def _send_join_request(self):
         """Send join request to server."""
         try:
-            join_data = encode_join_request(self.username)
-            self.sock.sendto(join_data, (self.host, self.port))
+            self.sock.sendto(self._join_data, self._server_addr)
             self.joined = True
             # 1. A warning message won't be shown if connection happens when the server is not running
             print("📡 Join request sent! You can now send messages.")
@@ -102,65 +161,107 @@ class ChatClient:
     def _send_disconnect_if_joined(self):
         """Send disconnect message to server if currently joined."""
         if self.joined and self.running:
-            try:
-                disconnect_data = encode_disconnect_request(self.username)
-                self.sock.sendto(disconnect_data, (self.host, self.port))
-                print("\n📤 Disconnect notification sent to server")
-                time.sleep(0.1)  # Give a moment for message to be sent
-            except Exception as e:
-                print(f"⚠️  Failed to send disconnect notification: {e}")
+            # Queue behind any pending chats, so the server gets them first;
+            # disconnect() waits for the sender to flush the outbox
+            self._outbox.put(self._disconnect_data)
+            print("\n📤 Disconnect notification sent to server")
 
     def _show_prompt(self):
         """Show the input prompt."""
-        print("🗣️ ", end="", flush=True)
-        self.prompt_shown = True
+        sys.stdout.write(PROMPT)
+        sys.stdout.flush()
+
+    def _display(self, line: str, prompt: bool = True):
+        """Replace the prompt row with line, then redraw the prompt, in one write."""
+        sys.stdout.write(f"{_CLEAR_LINE}{line}\n{PROMPT if prompt else ''}")
+        sys.stdout.flush()
 
     def _send_message(self, message: str):
         """Send a chat message to the server."""
         try:
-            encoded_message = encode_message(self.username, message, MSG_TYPE_CHAT)
-            self.sock.sendto(encoded_message, (self.host, self.port))
+            self._outbox.put(self._encode_chat(message))
         except Exception as e:
             print(f"\n❌ Failed to send message: {e}")
             if self.running:
                 self._show_prompt()
 
-    def _receive_messages(self):
-        """Receive and display messages from server."""
-        while self.running:
+    def _send_loop(self):
+        """Send queued chat packets, coalescing bursts into one syscall."""
+        while True:
+            packet = self._outbox.get()
+            if packet is None:
+                break
+
+            # Block for the first packet, then take whatever else is queued
+            batch = [packet]
+            while len(batch) < MAX_SEND_BATCH:
+                try:
+                    packet = self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if packet is None:
+                    self._outbox.put(None)  # Handle shutdown after this batch
+                    break
+                batch.append(packet)
+
             try:
-                data, _ = self.sock.recvfrom(MAX_MESSAGE_SIZE)
-                username, message, msg_type = decode_message(data)
-
-                # Clear current input line if prompt was shown
-                if self.prompt_shown:
-                    self._clear_input_line()
-
-                if msg_type == MSG_TYPE_SYSTEM:
-                    # Display system notifications
-                    print(f"🔔 {message}")
-                    if message[0] == "🛑":
-                        raise Exception(message)
-
-                    if (
-                        message
-                        == "⛔️ You have been disconnected from the chat due to being inactive for too log.\n Please enter 'join' to rejoin the chat."
-                    ):
-                        self.joined = False
-
-                elif msg_type == MSG_TYPE_CHAT and username != self.username:
-                    # Display chat messages from others
-                    print(f"💬 [{username}]: {message}")
-                # Restore input prompt
-                self._show_prompt()
+                errors = send_all(self.sock, batch, self._server_addr)
+            except OSError as e:
+                errors = [e]
+            for e in errors:
+                print(f"\n❌ Failed to send message: {e}")
+
+    def _start_receiver(self):
+        """Start a receiver process sharing the current socket."""
+        self._inbox = _RECEIVER_CONTEXT.Queue()
+        self._receiver_stopping = _RECEIVER_CONTEXT.Event()
+        self._receiver = _RECEIVER_CONTEXT.Process(
+            target=_receive_worker,
+            args=(self.sock, self._inbox, self._receiver_stopping),
+            daemon=True,
+        )
+        self._receiver.start()
+
+    def _stop_receiver(self):
+        """Stop the receiver so the socket can be closed or reused here."""
+        receiver, self._receiver = self._receiver, None
+        if receiver is None:
+            return
+        self._receiver_stopping.set()
+        try:
+            # Wakes the child's blocked recvfrom_into: shutdown acts on the shared
+            # socket, while close() here would only drop the parent's descriptor
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # ENOTCONN on an unconnected UDP socket, but the wake-up happens
+        receiver.join(timeout=1)
 
-            except socket.error:
+    def _receive_messages(self):
+        """Display messages decoded by the receiver."""
+        while self.running:
+            item = self._inbox.get()
+            if item is None:
+                # Receiver lost its socket
                 if self.running:
                     self._handle_connection_lost()
+                continue
 
-            except Exception:
-                if self.running:
+            username, message, msg_type = item
+
+            if msg_type == MSG_TYPE_SYSTEM:
+                # Display system notifications
+                if message == SHUTDOWN_NOTICE:
+                    self._display(f"🔔 {message}", prompt=False)
                     self._handle_connection_lost()
+                    continue
+
+                if message == INACTIVE_NOTICE:
+                    self.joined = False
+                self._display(f"🔔 {message}")
+
+            elif msg_type == MSG_TYPE_CHAT and username != self.username:
+                # Display chat messages from others
+                self._display(f"💬 [{username}]: {message}")
 
     def _handle_connection_lost(self):
         """Handle connection lost to server."""
@@ -168,6 +269,7 @@ class ChatClient:
         self.joined = False  # Need to rejoin when server comes back
 
         # Close current socket
+        self._stop_receiver()
         try:
             self.sock.close()
         except:
@@ -179,38 +281,32 @@ class ChatClient:
             try:
                 reconnect_attempts += 1
 
-                # Create fresh socket with timeout
+                # Create fresh socket
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self.sock.settimeout(3)  # 3 second timeout for ping test
 
                 # Send ping to test server availability
-                ping_data = encode_ping_request(self.username)
-                self.sock.sendto(ping_data, (self.host, self.port))
-
-                # Wait for pong response
-                try:
-                    data, _ = self.sock.recvfrom(MAX_MESSAGE_SIZE)
-                    _, message, msg_type = decode_message(data)
-
-                    # If we get a pong response, server is back
-                    if msg_type == MSG_TYPE_SYSTEM and message == "pong":
-                        self.sock.settimeout(
-                            None
-                        )  # Remove timeout for normal operation
-                        print(
-                            "\n✅ Connection restored! Please type 'join' to re-enter chat."
-                        )
-                        time.sleep(0.5)
-                        # Restore the prompt since main thread is still in input()
-                        self._show_prompt()
-                        break
-
-                except socket.timeout:
-                    # Server didn't respond to ping
-                    pass
-                except Exception:
-                    # Any other error means server might not be ready
-                    pass
+                self.sock.sendto(self._ping_data, self._server_addr)
+
+                # Wait up to 3 seconds for the pong; the socket itself stays blocking
+                readable, _, _ = select.select([self.sock], [], [], 3.0)
+                if readable:
+                    try:
+                        data, _ = self.sock.recvfrom(MAX_MESSAGE_SIZE)
+
+                        # If we get a pong response, server is back
+                        if data == PONG_PACKET:
+                            print(
+                                "\n✅ Connection restored! Please type 'join' to re-enter chat."
+                            )
+                            self._start_receiver()
+                            time.sleep(0.5)
+                            # Restore the prompt since main thread is still in input()
+                            self._show_prompt()
+                            break
+
+                    except Exception:
+                        # Any error means server might not be ready
+                        pass
 
             except Exception:
                 pass  # Connection failed, will retry
@@ -219,17 +315,15 @@ class ChatClient:
                 print(f"⏳ Still trying to reconnect... (attempt {reconnect_attempts})")
             time.sleep(5)  # Wait 5 seconds before retry
 
-    def _clear_input_line(self):
-        """Clear the current input line in terminal."""
-        # Move cursor to beginning of line and clear it
-        print("\r" + " " * 80 + "\r", end="", flush=True)
-        self.prompt_shown = False
-
     def disconnect(self):
         """Disconnect from the chat server."""
         print("\n✋ Disconnecting from Chat Server")
         self.running = False
         self.joined = False
+        self._outbox.put(None)
+        if self._sender is not None:
+            self._sender.join(timeout=1)  # Flush queued packets before closing
+        self._stop_receiver()
         self.sock.close()
         print("\n👋 Disconnected from Chat Server")
 
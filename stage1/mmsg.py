@@ -0,0 +1,421 @@
+"""
+Online Chat Messenger - Stage 1 Batched Datagram I/O
+ctypes bindings for Linux sendmmsg(2)/recvmmsg(2) so a broadcast, or a burst
+of inbound datagrams, costs one syscall instead of one per packet.
+Falls back to sendto()/recvfrom() elsewhere. stage2/mmsg.py links to this file.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+MAX_BATCH_SIZE = 1024  # UIO_MAXIOV: kernel limit on messages per sendmmsg call
+SOCKADDR_IN_SIZE = 16
+MSG_WAITFORONE = 0x10000  # recvmmsg: block for the first datagram only
+ADDR_CACHE_SIZE = 65536  # Distinct peers remembered by DatagramReceiver
+SEND_RETRY_SECONDS = 1.0  # How long a broadcast waits for a full send buffer
+# Send buffer full (non-blocking socket): wait and retry, the peer is not at fault
+_RETRY_ERRNOS = frozenset((errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS))
+
+_AF_INET_FAMILY = struct.pack("=H", socket.AF_INET)  # sin_family is host order
+_PORT_AND_ADDR = struct.Struct("!H4s8x")  # sin_port, sin_addr, sin_zero
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_SockAddrIn = ctypes.c_char * SOCKADDR_IN_SIZE
+_MMSGHDR_SIZE = ctypes.sizeof(_MMsgHdr)
+
+
+def _load_libc():
+    """Return libc when running on Linux, otherwise None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+
+
+def _load_sendmmsg(libc):
+    """Return libc's sendmmsg, or None when the platform doesn't provide it."""
+    sendmmsg = getattr(libc, "sendmmsg", None)
+    if sendmmsg is None:
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+def _load_recvmmsg(libc):
+    """Return libc's recvmmsg, or None when the platform doesn't provide it."""
+    recvmmsg = getattr(libc, "recvmmsg", None)
+    if recvmmsg is None:
+        return None
+    recvmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.c_uint,
+        ctypes.c_int,
+        ctypes.c_void_p,
+    ]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+_libc = _load_libc()
+_sendmmsg = _load_sendmmsg(_libc)
+_recvmmsg = _load_recvmmsg(_libc)
+HAVE_SENDMMSG = _sendmmsg is not None
+HAVE_RECVMMSG = _recvmmsg is not None
+
+
+def pack_sockaddr_in(addr: Tuple[str, int]) -> bytes:
+    """Pack an (ip, port) tuple into a struct sockaddr_in."""
+    ip, port = addr
+    return _AF_INET_FAMILY + _PORT_AND_ADDR.pack(port, socket.inet_aton(ip))
+
+
+def unpack_sockaddr_in(sockaddr: bytes) -> Tuple[str, int]:
+    """Unpack a struct sockaddr_in into an (ip, port) tuple."""
+    port, ip = _PORT_AND_ADDR.unpack_from(sockaddr, 2)
+    return socket.inet_ntoa(ip), port
+
+
+class SockaddrTable:
+    """
+    Broadcast destinations stored as parallel arrays: addresses in a list and
+    their packed sockaddr_in structs back to back in one bytearray.
+    """
+
+    def __init__(self):
+        self._addrs: List[Tuple[str, int]] = []
+        self._packed = bytearray()
+        self._index: Dict[Tuple[str, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._addrs)
+
+    def __contains__(self, addr) -> bool:
+        return addr in self._index
+
+    def add(self, addr: Tuple[str, int]):
+        """Add a destination (no-op if already present)."""
+        if addr in self._index:
+            return
+        self._index[addr] = len(self._addrs)
+        self._addrs.append(addr)
+        self._packed += pack_sockaddr_in(addr)
+
+    def remove(self, addr: Tuple[str, int]):
+        """Remove a destination in O(1) by moving the last entry into its slot."""
+        i = self._index.pop(addr, None)
+        if i is None:
+            return
+        last = len(self._addrs) - 1
+        if i != last:
+            moved = self._addrs[last]
+            self._addrs[i] = moved
+            self._index[moved] = i
+            start = i * SOCKADDR_IN_SIZE
+            self._packed[start : start + SOCKADDR_IN_SIZE] = self._packed[
+                last * SOCKADDR_IN_SIZE :
+            ]
+        self._addrs.pop()
+        del self._packed[last * SOCKADDR_IN_SIZE :]
+
+    def snapshot(
+        self, exclude: Tuple[str, int] = None
+    ) -> Tuple[List[Tuple[str, int]], bytes]:
+        """Return (addrs, packed_names) for every destination except exclude."""
+        i = self._index.get(exclude) if exclude is not None else None
+        if i is None:
+            return self._addrs[:], bytes(self._packed)
+
+        start = i * SOCKADDR_IN_SIZE
+        end = start + SOCKADDR_IN_SIZE
+        return (
+            self._addrs[:i] + self._addrs[i + 1 :],
+            bytes(self._packed[:start] + self._packed[end:]),
+        )
+
+
+def _wait_writable(fd: int, deadline: float) -> bool:
+    """Wait until fd has send buffer space; False once the monotonic deadline passes."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    _, writable, _ = select.select((), (fd,), (), remaining)
+    return bool(writable)
+
+
+class DatagramBatcher:
+    """Sends one payload to many peers with a single sendmmsg(2) call."""
+
+    def __init__(self, sock: socket.socket, capacity: int = 64):
+        self.sock = sock
+        self._iov = _IOVec()
+        self._capacity = 0
+        self._reserve(capacity)
+
+    def _reserve(self, count: int):
+        """Grow the reusable mmsghdr/sockaddr arrays to hold `count` messages."""
+        if count <= self._capacity:
+            return
+
+        capacity = max(count, self._capacity * 2)
+        self._msgs = (_MMsgHdr * capacity)()
+        self._names = (_SockAddrIn * capacity)()
+
+        # Every message shares the same iovec: same payload, different destination
+        iov_ptr = ctypes.pointer(self._iov)
+        for i in range(capacity):
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._names[i])
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_iov = iov_ptr
+            hdr.msg_iovlen = 1
+        self._capacity = capacity
+
+    def send(
+        self,
+        payload: Buffer,
+        addrs: Sequence[Tuple[str, int]],
+        packed_names: bytes = None,
+    ) -> List[Tuple[Tuple[str, int], OSError]]:
+        """
+        Send payload (bytes or a writable buffer, e.g. a receive view) to every address.
+        packed_names: optional pre-packed sockaddr_in structs for addrs, concatenated.
+        Returns: [(addr, error)] for each destination that could not be sent to.
+        A full send buffer is waited out (up to SEND_RETRY_SECONDS), not reported:
+        after that the rest of the broadcast is dropped, as UDP may drop anyway.
+        """
+        if not HAVE_SENDMMSG:
+            return self._send_each(payload, addrs)
+
+        count = len(addrs)
+        self._reserve(count)
+        if packed_names is None:
+            packed_names = b"".join([pack_sockaddr_in(addr) for addr in addrs])
+        ctypes.memmove(self._names, packed_names, count * SOCKADDR_IN_SIZE)
+
+        # Point the iovec straight at the caller's buffer, no copy
+        if isinstance(payload, bytes):
+            payload_ref = ctypes.c_char_p(payload)
+            self._iov.iov_base = ctypes.cast(payload_ref, ctypes.c_void_p)
+        else:
+            payload_ref = (ctypes.c_char * len(payload)).from_buffer(payload)
+            self._iov.iov_base = ctypes.addressof(payload_ref)
+        self._iov.iov_len = len(payload)
+
+        failed = []
+        fd = self.sock.fileno()
+        base = ctypes.addressof(self._msgs)
+        sent = 0
+        deadline = None
+        while sent < count:
+            vlen = min(count - sent, MAX_BATCH_SIZE)
+            n = _sendmmsg(fd, base + sent * _MMSGHDR_SIZE, vlen, 0)
+            if n > 0:
+                sent += n
+                continue
+
+            err = ctypes.get_errno()
+            if err in _RETRY_ERRNOS:
+                if deadline is None:
+                    deadline = time.monotonic() + SEND_RETRY_SECONDS
+                if _wait_writable(fd, deadline):
+                    continue
+                break  # Still full: drop the rest rather than blame the peers
+
+            # sendmmsg stops at the first failing datagram; record it and move on
+            failed.append((addrs[sent], OSError(err, os.strerror(err))))
+            sent += 1
+        return failed
+
+    def _send_each(
+        self, payload: Buffer, addrs: Sequence[Tuple[str, int]]
+    ) -> List[Tuple[Tuple[str, int], OSError]]:
+        """Portable fallback: one sendto() per destination."""
+        failed = []
+        deadline = None
+        for addr in addrs:
+            while True:
+                try:
+                    self.sock.sendto(payload, addr)
+                except socket.error as e:
+                    if e.errno in _RETRY_ERRNOS:
+                        if deadline is None:
+                            deadline = time.monotonic() + SEND_RETRY_SECONDS
+                        if _wait_writable(self.sock.fileno(), deadline):
+                            continue
+                        return failed  # Still full: drop the rest
+                    failed.append((addr, e))
+                break
+        return failed
+
+
+def send_all(
+    sock: socket.socket,
+    payloads: Sequence[bytes],
+    addr: Optional[Tuple[str, int]] = None,
+) -> List[OSError]:
+    """
+    Send several payloads to one address with a single sendmmsg(2) call.
+    addr: destination, or None to use the peer of a connected socket.
+    Returns: an error for each payload that could not be sent.
+    """
+    if not HAVE_SENDMMSG:
+        errors = []
+        for payload in payloads:
+            try:
+                if addr is None:
+                    sock.send(payload)
+                else:
+                    sock.sendto(payload, addr)
+            except socket.error as e:
+                errors.append(e)
+        return errors
+
+    count = len(payloads)
+    msgs = (_MMsgHdr * count)()
+    iovs = (_IOVec * count)()
+    name = None  # Connected socket: the kernel supplies the peer
+    if addr is not None:
+        name = _SockAddrIn.from_buffer_copy(pack_sockaddr_in(addr))
+    refs = [ctypes.c_char_p(payload) for payload in payloads]  # Keep pointers alive
+    for i, payload in enumerate(payloads):
+        iovs[i].iov_base = ctypes.cast(refs[i], ctypes.c_void_p)
+        iovs[i].iov_len = len(payload)
+        hdr = msgs[i].msg_hdr
+        if name is not None:
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+
+    errors = []
+    fd = sock.fileno()
+    base = ctypes.addressof(msgs)
+    sent = 0
+    while sent < count:
+        n = _sendmmsg(fd, base + sent * _MMSGHDR_SIZE, count - sent, 0)
+        if n > 0:
+            sent += n
+            continue
+
+        err = ctypes.get_errno()
+        errors.append(OSError(err, os.strerror(err)))
+        sent += 1
+    return errors
+
+
+class DatagramReceiver:
+    """Drains up to `batch_size` queued datagrams per recvmmsg(2) call."""
+
+    def __init__(self, sock: socket.socket, buffer_size: int, batch_size: int = 32):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+
+        # Raw sockaddr_in -> shared (ip, port) tuple, so known peers skip unpacking
+        self._addr_cache: Dict[bytes, Tuple[str, int]] = {}
+
+        # Reusable receive buffers: one per message slot
+        self._buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+
+        if HAVE_RECVMMSG:
+            self._msgs = (_MMsgHdr * batch_size)()
+            self._names = (_SockAddrIn * batch_size)()
+            self._iovs = (_IOVec * batch_size)()
+            # Keep the exported buffers alive (and unresizable) for the kernel
+            self._exports = [ctypes.c_char.from_buffer(b) for b in self._buffers]
+            for i in range(batch_size):
+                self._iovs[i].iov_base = ctypes.addressof(self._exports[i])
+                self._iovs[i].iov_len = buffer_size
+                hdr = self._msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(self._names[i])
+                hdr.msg_iov = ctypes.pointer(self._iovs[i])
+                hdr.msg_iovlen = 1
+
+    def recv(self) -> List[Tuple[memoryview, Tuple[str, int]]]:
+        """
+        Return the queued datagrams; blocking sockets wait for the first one.
+        Returns: [(data, addr)]; data views are only valid until the next call.
+        """
+        if not HAVE_RECVMMSG:
+            return self._recv_each()
+
+        msgs = self._msgs
+        for i in range(self.batch_size):
+            msgs[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE  # In/out: reset per call
+
+        while True:
+            n = _recvmmsg(
+                self.sock.fileno(),
+                ctypes.addressof(msgs),
+                self.batch_size,
+                MSG_WAITFORONE,
+                None,
+            )
+            if n >= 0:
+                break
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []  # Non-blocking socket with nothing queued
+            if err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+        views, names, cache = self._views, self._names, self._addr_cache
+        batch = []
+        for i in range(n):
+            raw = names[i].raw
+            addr = cache.get(raw)
+            if addr is None:
+                if len(cache) >= ADDR_CACHE_SIZE:
+                    cache.clear()
+                addr = cache[raw] = unpack_sockaddr_in(raw)
+            batch.append((views[i][: msgs[i].msg_len], addr))
+        return batch
+
+    def _recv_each(self) -> List[Tuple[memoryview, Tuple[str, int]]]:
+        """Portable fallback: recvfrom_into() the pooled buffers, one per datagram."""
+        drain = self.sock.gettimeout() == 0.0  # Only non-blocking sockets can drain
+        batch = []
+        for view in self._views:
+            try:
+                nbytes, addr = self.sock.recvfrom_into(view)
+            except BlockingIOError:
+                break
+            batch.append((view[:nbytes], addr))
+            if not drain:
+                break
+        return batch
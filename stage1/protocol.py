@@ -3,6 +3,10 @@ Online Chat Messenger - Stage 1 Protocol
 Protocol definitions and utilities for Stage 1 UDP messaging.
 """
 
+import functools
+import struct
+from typing import Callable, Union
+
 MAX_MESSAGE_SIZE = 4096
 MAX_USERNAME_LENGTH = 255
 
@@ -14,14 +18,26 @@ MSG_TYPE_HEARTBEAT = 3  # Connection heartbeat
 MSG_TYPE_DISCONNECT = 4  # Disconnect notification
 MSG_TYPE_PING = 5  # Connection test ping
 
+# Header: [msg_type(1 byte)][username_len(1 byte)]
+_HEADER = struct.Struct("BB")
+HEADER_SIZE = _HEADER.size
+_pack_header_into = _HEADER.pack_into
+_unpack_header = _HEADER.unpack_from
+
 
-def encode_message(username: str, message: str, msg_type: int = MSG_TYPE_CHAT) -> bytes:
+def encode_message(
+    username: Union[str, bytes],
+    message: Union[str, bytes],
+    msg_type: int = MSG_TYPE_CHAT,
+) -> bytes:
     """
     Encode a message according to Stage 1 protocol.
     Format: [msg_type(1 byte)][username_len(1 byte)][username][message]
+    username and message may be given already UTF-8 encoded, skipping the encode.
     """
-    username_bytes = username.encode("utf-8")
-    message_bytes = message.encode("utf-8")
+    # Argument-less encode() is UTF-8 without looking up the codec by name
+    username_bytes = username if isinstance(username, bytes) else username.encode()
+    message_bytes = message if isinstance(message, bytes) else message.encode()
 
     # Validate username length
     if len(username_bytes) > MAX_USERNAME_LENGTH:
@@ -29,30 +45,69 @@ def encode_message(username: str, message: str, msg_type: int = MSG_TYPE_CHAT) -
             f"Username too long: {len(username_bytes)} > {MAX_USERNAME_LENGTH}"
         )
 
-    # Create the packet: [msg_type][username_len][username][message]
-    packet = bytes([msg_type, len(username_bytes)]) + username_bytes + message_bytes
-    if len(packet) > MAX_MESSAGE_SIZE:
-        raise ValueError(f"Message too long: {len(packet)} > {MAX_MESSAGE_SIZE}")
+    # Create the packet in one buffer: [msg_type][username_len][username][message]
+    body_start = HEADER_SIZE + len(username_bytes)
+    packet_size = body_start + len(message_bytes)
+    if packet_size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message too long: {packet_size} > {MAX_MESSAGE_SIZE}")
+
+    packet = bytearray(packet_size)
+    _pack_header_into(packet, 0, msg_type, len(username_bytes))
+    packet[HEADER_SIZE:body_start] = username_bytes
+    packet[body_start:] = message_bytes
 
-    return packet
+    return bytes(packet)
+
+
+def make_chat_encoder(username: str) -> Callable[[str], bytes]:
+    """
+    Build a chat encoder specialised for one username.
+    The header and username are packed once; each call only encodes the message.
+    """
+    username_bytes = username.encode()
+    if len(username_bytes) > MAX_USERNAME_LENGTH:
+        raise ValueError(
+            f"Username too long: {len(username_bytes)} > {MAX_USERNAME_LENGTH}"
+        )
+
+    prefix = _HEADER.pack(MSG_TYPE_CHAT, len(username_bytes)) + username_bytes
+    max_body = MAX_MESSAGE_SIZE - len(prefix)
+
+    def encode_chat(message: str, _prefix=prefix, _max_body=max_body) -> bytes:
+        message_bytes = message.encode()
+        if len(message_bytes) > _max_body:
+            raise ValueError(
+                f"Message too long: {len(_prefix) + len(message_bytes)} > {MAX_MESSAGE_SIZE}"
+            )
+        return _prefix + message_bytes
+
+    return encode_chat
+
+
+@functools.lru_cache(maxsize=1024)
+def _decode_username(username_bytes: bytes) -> str:
+    """Decode a username; the same few usernames repeat on every packet."""
+    return username_bytes.decode()
 
 
 def decode_message(data: bytes) -> tuple[str, str, int]:
     """
     Decode a message according to Stage 1 protocol.
+    Accepts any bytes-like object (bytes, bytearray, memoryview).
     Returns: (username, message, msg_type)
     """
-    if len(data) < 2:
+    if len(data) < HEADER_SIZE:
         raise ValueError("Invalid message: too short")
 
-    msg_type = data[0]
-    username_len = data[1]
+    msg_type, username_len = _unpack_header(data)
+    body_start = HEADER_SIZE + username_len
 
-    if len(data) < 2 + username_len:
+    if len(data) < body_start:
         raise ValueError("Invalid message: incomplete username")
 
-    username = data[2 : 2 + username_len].decode("utf-8")
-    message = data[2 + username_len :].decode("utf-8")
+    view = memoryview(data)
+    username = _decode_username(bytes(view[HEADER_SIZE:body_start]))
+    message = str(view[body_start:], "utf-8")  # Decodes straight from the buffer
 
     return username, message, msg_type
 
@@ -83,3 +138,13 @@ def encode_ping_request(username: str) -> bytes:
     Encode a ping request for connection testing.
     """
     return encode_message(username, "ping", MSG_TYPE_PING)
+
+
+# Fixed server notices: encoded once, matched by value on the client
+PONG_NOTICE = "pong"
+SHUTDOWN_NOTICE = "🛑 Server is shutting down. Please wait until it comes back."
+INACTIVE_NOTICE = "⛔️ You have been disconnected from the chat due to being inactive for too log.\n Please enter 'join' to rejoin the chat."
+
+PONG_PACKET = encode_system_message(PONG_NOTICE)
+SHUTDOWN_PACKET = encode_system_message(SHUTDOWN_NOTICE)
+INACTIVE_PACKET = encode_system_message(INACTIVE_NOTICE)
@@ -3,33 +3,67 @@ Online Chat Messenger - Stage 1 Client
 UDP-based chat server that broadcasts messages to all connected clients.
 """
 
+import asyncio
+import functools
+import heapq
+import queue
 import socket
 import threading
 import time
-from typing import Dict, Tuple
+from typing import Dict, List, Set, Tuple, Union
 
 try:
     from .protocol import (
+        HEADER_SIZE,
+        INACTIVE_PACKET,
         MAX_MESSAGE_SIZE,
         MSG_TYPE_CHAT,
         MSG_TYPE_DISCONNECT,
         MSG_TYPE_JOIN,
         MSG_TYPE_PING,
+        PONG_PACKET,
+        SHUTDOWN_PACKET,
         decode_message,
-        encode_message,
         encode_system_message,
     )
+    from .mmsg import DatagramBatcher, DatagramReceiver, SockaddrTable
 except ImportError:
     from protocol import (
+        HEADER_SIZE,
+        INACTIVE_PACKET,
         MAX_MESSAGE_SIZE,
         MSG_TYPE_CHAT,
         MSG_TYPE_DISCONNECT,
         MSG_TYPE_JOIN,
         MSG_TYPE_PING,
+        PONG_PACKET,
+        SHUTDOWN_PACKET,
         decode_message,
-        encode_message,
         encode_system_message,
     )
+    from mmsg import DatagramBatcher, DatagramReceiver, SockaddrTable
+
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # Absorb broadcast bursts without drops
+Buffer = Union[bytes, bytearray, memoryview]
+CLIENT_TIMEOUT_SECONDS = 60  # 1 minute timeout for better responsiveness
+CLIENT_TIMEOUT_NS = CLIENT_TIMEOUT_SECONDS * 1_000_000_000
+CLEANUP_INTERVAL_SECONDS = 10
+
+TOO_LONG_PACKET = encode_system_message(
+    "Your message exceeds 4096 characters. Please enter a shorter message."
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _join_notice(username: str) -> bytes:
+    """Encode the join broadcast; usernames rejoin, so cache per name."""
+    return encode_system_message(f"🎉 {username} has joined the chat")
+
+
+@functools.lru_cache(maxsize=4096)
+def _leave_notice(username: str) -> bytes:
+    """Encode the leave broadcast; usernames rejoin, so cache per name."""
+    return encode_system_message(f"👋 {username} has left the chat...")
 
 
 class ChatServer:
@@ -37,11 +71,26 @@ class ChatServer:
         self.host = host
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.clients: Dict[Tuple[str, int], float] = {}  # All connected clients
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        self.batcher = DatagramBatcher(self.sock)  # sendmmsg fanout for broadcasts
+        self.receiver = DatagramReceiver(self.sock, MAX_MESSAGE_SIZE)  # recvmmsg
+        self.clients: Dict[Tuple[str, int], int] = {}  # {addr: last_seen_ns}
         self.joined_clients: Dict[
             Tuple[str, int], str
         ] = {}  # {addr: username} for joined clients
+        self._peers = SockaddrTable()  # Joined addrs + packed sockaddrs for fanout
+        # Min-heap of (deadline_ns, addr): one entry per client, re-armed lazily
+        self._deadlines: List[Tuple[int, Tuple[str, int]]] = []
+        self._armed: Set[Tuple[str, int]] = set()  # Addrs with an entry in the heap
+        # (payload, targets, packed_names) for the sender thread; None stops it
+        self._outbox = queue.SimpleQueue()
+        self._broadcaster = None
         self.running = False
+        self._loop = None  # asyncio loop driving the server once started
+        self._stopped = None  # asyncio.Event set by stop()
+        self._cleanup_timer = None  # asyncio.TimerHandle for the next cleanup
+        self._stop_once = threading.Lock()  # Taken by the first stop(), never released
 
     def start(self):
         """Start the UDP chat server."""
@@ -51,46 +100,72 @@ class ChatServer:
             print(f"\n🚀 Chat Server started on {self.host}:{self.port}")
             print("👥 Waiting for clients to connect...")
 
-            # Start client cleanup thread
-            cleanup_thread = threading.Thread(target=self._cleanup_inactive_clients)
-            cleanup_thread.daemon = True
-            cleanup_thread.start()
+            # Fan out broadcasts on their own thread so sends never delay receives
+            self._broadcaster = threading.Thread(target=self._broadcast_loop)
+            self._broadcaster.daemon = True
+            self._broadcaster.start()
 
-            # main server loop
-            while self.running:
-                try:
-                    data, addr = self.sock.recvfrom(MAX_MESSAGE_SIZE)
-                    self._handle_message(data, addr)
-                except socket.error as e:
-                    if self.running:
-                        print(f"\n❌ Socket error: {e}")
-                except KeyboardInterrupt:
-                    print("\n👋 Server shutting down...")
-                    break
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            print("\n👋 Server shutting down...")
         except Exception as e:
             print(f"\n❌ Sever error: {e}")
         finally:
             self.stop()
 
-    def _handle_message(self, data: bytes, addr: tuple):
-        """Handle incoming messages from clients."""
+    async def _serve(self):
+        """Serve datagrams on the event loop until stop() is called."""
+        self._stopped = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        fd = self.sock.fileno()
+
+        self.sock.setblocking(False)
+        self._loop.add_reader(fd, self._on_readable)
+        self._cleanup_timer = self._loop.call_later(
+            CLEANUP_INTERVAL_SECONDS, self._cleanup_inactive_clients
+        )
+        try:
+            if self.running:  # stop() may have run before the loop was published
+                await self._stopped.wait()
+        finally:
+            self._cleanup_timer.cancel()
+            self._loop.remove_reader(fd)
+
+    def _on_readable(self):
+        """Drain queued datagrams when the socket becomes readable."""
+        try:
+            batch = self.receiver.recv()
+        except socket.error as e:
+            if self.running:
+                print(f"\n❌ Socket error: {e}")
+            return
+
+        now = time.monotonic_ns()  # One clock read covers the whole batch
+        for data, addr in batch:
+            self._handle_message(data, addr, now)
+
+    def _handle_message(self, data: bytes, addr: tuple, now: int):
+        """Handle incoming messages from clients received at monotonic time now."""
         try:
             # Update client's last_seen time
-            self.clients[addr] = time.time()
+            clients = self.clients
+            # A disconnected addr may still have a pending entry; don't add another
+            if addr not in self._armed:
+                self._armed.add(addr)
+                heapq.heappush(self._deadlines, (now + CLIENT_TIMEOUT_NS, addr))
+            clients[addr] = now
 
             # Decode message
             username, message, msg_type = decode_message(data)
-            if len(message) > MAX_MESSAGE_SIZE - 2 - len(username.encode("utf-8")):
-                message_too_long = "Your message exceeds 4096 characters. Please enter a shorter message."
-                self._broadcast_to_personal(
-                    encode_system_message(message_too_long), addr
-                )
+            # data[1] is the username's encoded length, so nothing is re-encoded
+            if len(message) > MAX_MESSAGE_SIZE - HEADER_SIZE - data[1]:
+                self._broadcast_to_personal(TOO_LONG_PACKET, addr)
                 return
 
             if msg_type == MSG_TYPE_JOIN:
                 self._handle_join_request(username, addr)
             elif msg_type == MSG_TYPE_CHAT:
-                self._handle_chat_message(username, message, addr)
+                self._handle_chat_message(username, message, addr, data)
             elif msg_type == MSG_TYPE_DISCONNECT:
                 self._handle_disconnect_request(username, addr)
             elif msg_type == MSG_TYPE_PING:
@@ -105,22 +180,23 @@ class ChatServer:
         """Handle client join request."""
         if addr not in self.joined_clients:
             self.joined_clients[addr] = username
+            self._peers.add(addr)
             print(f"✅ {username} joined from {addr[0]}:{addr[1]}")
 
             # Broadcast join notification to all joined clients
-            join_message = encode_system_message(f"🎉 {username} has joined the chat")
-            self._broadcast_to_joined(join_message, exclude_addr=None)
+            self._broadcast_to_joined(_join_notice(username), exclude_addr=None)
         else:
             print(f"🔄 {username} already joined from {addr}")
 
-    def _handle_chat_message(self, username: str, message: str, addr: tuple):
+    def _handle_chat_message(
+        self, username: str, message: str, addr: tuple, data: memoryview
+    ):
         """Handle regular chat message."""
         # Only allow chat from joined clients
         if addr in self.joined_clients:
             print(f"💬 [{username}] from {addr[0]}:{addr[1]}: {message}")
-            # Broadcast to joined clients only
-            chat_data = encode_message(username, message, MSG_TYPE_CHAT)
-            self._broadcast_to_joined(chat_data, exclude_addr=addr)
+            # Relay the datagram as received: re-encoding yields identical bytes
+            self._broadcast_to_joined(data, exclude_addr=addr)
         else:
             print(f"🚫 Chat message from non-joined client {addr} ignored")
 
@@ -135,28 +211,47 @@ class ChatServer:
         """Handle ping request for connection testing."""
         try:
             # Respond with a simple pong message
-            pong_message = encode_system_message("pong")
-            self.sock.sendto(pong_message, addr)
+            self.sock.sendto(PONG_PACKET, addr)
             print(
                 f"🏓 Ping from {username} at {addr[0]}:{addr[1]} - responded with pong"
             )
         except Exception as e:
             print(f"❌ Failed to respond to ping from {addr}: {e}")
 
-    def _broadcast_to_joined(self, message_data: bytes, exclude_addr: tuple = None):
+    def _broadcast_to_joined(self, message_data: Buffer, exclude_addr: tuple = None):
         """Broadcast a message to all joined clients."""
-        disconnected_clients = []
-
-        for client_addr in self.joined_clients.keys():
-            if client_addr != exclude_addr:
+        # Snapshot the registry: failed sends below disconnect (mutate) clients
+        targets, packed_names = self._peers.snapshot(exclude_addr)
+        if not targets:
+            return
+
+        if self._broadcaster is None:
+            failed = self.batcher.send(message_data, targets, packed_names)
+            self._handle_send_failures(failed)
+        else:
+            # Copy: the data may be a receive-buffer view that the next recv reuses
+            self._outbox.put((bytes(message_data), targets, packed_names))
+
+    def _broadcast_loop(self):
+        """Send queued broadcasts until stop() posts the None sentinel."""
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                break
+
+            payload, targets, packed_names = item
+            failed = self.batcher.send(payload, targets, packed_names)
+            if failed:
+                # Client state belongs to the event loop; hand failures back to it
                 try:
-                    self.sock.sendto(message_data, client_addr)
-                except socket.error as e:
-                    print(f"\n❌ Failed to send to {client_addr}: {e}")
-                    disconnected_clients.append(client_addr)
-
-        # Handle disconnected clients
-        for addr in disconnected_clients:
+                    self._loop.call_soon_threadsafe(self._handle_send_failures, failed)
+                except (AttributeError, RuntimeError):
+                    pass  # Loop not running: the server is stopping anyway
+
+    def _handle_send_failures(self, failed: List[Tuple[Tuple[str, int], OSError]]):
+        """Disconnect clients whose broadcast could not be delivered."""
+        for addr, e in failed:
+            print(f"\n❌ Failed to send to {addr}: {e}")
             self._handle_client_disconnect(addr, False)
 
     def _broadcast_to_personal(self, message_data: bytes, client_addr: tuple):
@@ -171,64 +266,84 @@ class ChatServer:
         if addr in self.joined_clients:
             username = self.joined_clients[addr]
             del self.joined_clients[addr]
+            self._peers.remove(addr)
 
             # If the disconnect is not explicit, notify the client
             if not explicit_disconnect:
                 # Notify the client has been disconnected
                 print(f"🚪 {username} disconnected from {addr}")
-                personal_message = "⛔️ You have been disconnected from the chat due to being inactive for too log.\n Please enter 'join' to rejoin the chat."
-                encoded_personal_message = encode_system_message(personal_message)
-                self._broadcast_to_personal(encoded_personal_message, addr)
+                self._broadcast_to_personal(INACTIVE_PACKET, addr)
 
             # Notify other joined clients about the disconnection
-            encoded_broadcast_message = encode_system_message(
-                f"👋 {username} has left the chat..."
-            )
-            self._broadcast_to_joined(encoded_broadcast_message, exclude_addr=None)
+            self._broadcast_to_joined(_leave_notice(username), exclude_addr=None)
 
         # Remove from general client list too
         if addr in self.clients:
             del self.clients[addr]
 
     def _cleanup_inactive_clients(self):
-        """Remove inactive clients periodically."""
-        TIMEOUT_SECONDS = 60  # 1 minute timeout for better responsiveness
-
-        while self.running:
-            current_time = time.time()
-            inactive_clients = []
-
-            for addr, last_seen in self.clients.items():
-                if current_time - last_seen > TIMEOUT_SECONDS:
-                    inactive_clients.append(addr)
-
-            # Remove inactive clients with proper disconnect handling
-            for addr in inactive_clients:
-                print(f"⏰ Client {addr} timed out after {TIMEOUT_SECONDS} seconds")
-                self._handle_client_disconnect(addr, False)
+        """Remove inactive clients, then re-arm the cleanup timer."""
+        deadlines = self._deadlines
+        current_time = time.monotonic_ns()
+
+        # Only pop entries that are due; clients seen since then are re-armed
+        while deadlines and deadlines[0][0] <= current_time:
+            _, addr = heapq.heappop(deadlines)
+            last_seen = self.clients.get(addr)
+            if last_seen is None:
+                self._armed.discard(addr)  # Already disconnected
+                continue
+            if current_time - last_seen < CLIENT_TIMEOUT_NS:
+                heapq.heappush(deadlines, (last_seen + CLIENT_TIMEOUT_NS, addr))
+                continue
+
+            self._armed.discard(addr)
+            print(f"⏰ Client {addr} timed out after {CLIENT_TIMEOUT_SECONDS} seconds")
+            self._handle_client_disconnect(addr, False)
 
-            time.sleep(10)  # Check every 10 seconds
+        if self.running:
+            self._cleanup_timer = self._loop.call_later(
+                CLEANUP_INTERVAL_SECONDS, self._cleanup_inactive_clients
+            )
 
     def stop(self):
-        """Stop the chat server."""
+        """Stop the chat server; later calls (e.g. from start()'s finally) do nothing."""
+        if not self._stop_once.acquire(blocking=False):
+            return
         print("\n✋ Stopping Chat Server...")
 
         # Notify all joined clients about server shutdown
         if self.joined_clients:
-            shutdown_message = encode_system_message(
-                "🛑 Server is shutting down. Please wait until it comes back."
-            )
-            self._broadcast_to_joined(shutdown_message, exclude_addr=None)
+            self._broadcast_to_joined(SHUTDOWN_PACKET, exclude_addr=None)
             print(f"\n📢 Notified {len(self.joined_clients)} clients about shutdown")
 
             # Give time for shutdown messages to be sent
             time.sleep(0.5)
 
         self.running = False
-        if hasattr(self, "sock"):
-            self.sock.close()
+        self._wake_loop()
+        self._stop_broadcaster()
+        self.sock.close()
         print("👋 Server stopped.")
 
+    def _stop_broadcaster(self):
+        """Let the sender thread flush queued broadcasts, then stop it."""
+        broadcaster = self._broadcaster
+        if broadcaster is not None:
+            self._outbox.put(None)
+            broadcaster.join(timeout=1)
+            self._broadcaster = None  # Later broadcasts send inline
+
+    def _wake_loop(self):
+        """Ask the event loop to finish serving; safe from any thread."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._stopped.set)
+        except RuntimeError:
+            pass  # Loop closed in the meantime
+
 
 if __name__ == "__main__":
     server = ChatServer()
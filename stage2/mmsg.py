@@ -0,0 +1 @@
+../stage1/mmsg.py
\ No newline at end of file
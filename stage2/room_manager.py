@@ -3,7 +3,36 @@
 Room manager for chat rooms. Manages room state and participants.
 """
 
+import threading
 import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class Roster(NamedTuple):
+    """Participant columns, aligned by position; index maps token -> position"""
+
+    tokens: Tuple[str, ...] = ()
+    usernames: Tuple[str, ...] = ()
+    ips: Tuple[str, ...] = ()
+    joined_at: Tuple[float, ...] = ()
+    username_bytes: Tuple[bytes, ...] = ()  # UTF-8 usernames, encoded at join
+    index: Dict[str, int] = {}
+
+
+_COLUMNS = len(Roster._fields) - 1  # Every field but index is a column
+
+
+def _build_roster(tokens, usernames, ips, joined_at, username_bytes) -> Roster:
+    """Freeze the columns and index them by token"""
+    tokens = tuple(tokens)
+    return Roster(
+        tokens,
+        tuple(usernames),
+        tuple(ips),
+        tuple(joined_at),
+        tuple(username_bytes),
+        {token: i for i, token in enumerate(tokens)},
+    )
 
 
 class Room:
@@ -18,20 +47,33 @@ class Room:
         self.password = password
         self.created_at = time.time()
 
-        # Participants: { token: { username, ip, joined_at}}
-        self.participants = {}
+        # Participants as parallel columns (token, username, ip, joined_at, bytes)
+        # Copy-on-write: mutators swap in a new Roster, so readers holding the
+        # old one (e.g. UDP broadcasts) always see aligned, unchanging columns
+        self.roster = Roster()
+        self._participants_lock = threading.Lock()  # Serializes mutators only
+
+        # UDP addresses: { token: ((ip, port), packed sockaddr) }, also copy-on-write.
+        # targets holds (addrs, packed sockaddrs) for broadcasting, in roster order.
+        self.addresses = {}
+        self.targets = ((), b"")
 
         # Host gets the first token
         self.host_token = None
 
     def add_participant(self, token: str, username: str, ip: str) -> bool:
         """Add a participant to the room"""
-        self.participants[token] = {
-            "username": username,
-            "ip": ip,
-            "joined_at": time.time(),
-            "is_host": username == self.host_username,
-        }
+        with self._participants_lock:
+            columns = [list(column) for column in self.roster[:_COLUMNS]]
+            row = (token, username, ip, time.time(), username.encode("utf-8"))
+            i = self.roster.index.get(token)
+            for column, value in zip(columns, row):
+                if i is None:
+                    column.append(value)
+                else:
+                    column[i] = value
+            self.roster = _build_roster(*columns)
+            self._refresh_targets()
 
         if username == self.host_username:
             self.host_token = token
@@ -40,18 +82,54 @@ class Room:
 
     def remove_participant(self, token: str) -> bool:
         """Remove a participant from the room"""
-        if token in self.participants:
-            del self.participants[token]
-            return True
-        return False
+        with self._participants_lock:
+            i = self.roster.index.get(token)
+            if i is None:
+                return False
+            columns = [
+                column[:i] + column[i + 1 :] for column in self.roster[:_COLUMNS]
+            ]
+            self.roster = _build_roster(*columns)
+            if token in self.addresses:
+                addresses = dict(self.addresses)
+                del addresses[token]
+                self.addresses = addresses
+            self._refresh_targets()
+        return True
+
+    def set_address(
+        self, token: str, addr: Tuple[str, int], packed_addr: bytes
+    ) -> Optional[Tuple[str, int]]:
+        """Record a participant's UDP address, returning the previous one"""
+        with self._participants_lock:
+            previous = self.addresses.get(token)
+            if token not in self.roster.index:
+                return None  # Left the room meanwhile
+            addresses = dict(self.addresses)
+            addresses[token] = (addr, packed_addr)
+            self.addresses = addresses
+            self._refresh_targets()
+        return previous[0] if previous else None
+
+    def _refresh_targets(self):
+        """Rebuild the broadcast targets; callers hold _participants_lock"""
+        entries = [
+            entry
+            for token in self.roster.tokens
+            if (entry := self.addresses.get(token)) is not None
+        ]
+        self.targets = (
+            tuple(addr for addr, _ in entries),
+            b"".join([packed for _, packed in entries]),
+        )
 
     def is_host_active(self) -> bool:
         """Check if the room host is still active"""
-        return self.host_token is not None and self.host_token in self.participants
+        return self.host_token is not None and self.host_token in self.roster.index
 
     def get_participant_count(self) -> int:
         """Get current number of participants in the room"""
-        return len(self.participants)
+        return len(self.roster.tokens)
 
     def validate_password(self, password: str) -> bool:
         """Validate room password"""
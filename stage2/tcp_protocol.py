@@ -6,12 +6,23 @@ TCP Chat Room Protocol (TCRP) Implementation for Stage 2
 Handles room creation, joining, and token management via reliable TCP connections.
 """
 
+import binascii
+import collections
+import functools
 import hashlib
 import json
-import secrets
+import os
+import re
+import socket
 import struct
+import time
 from enum import IntEnum
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson  # Optional: C-backed JSON that reads and writes bytes directly
+except ImportError:
+    orjson = None
 
 # Protocol Constants
 HEADER_SIZE = 32  # 32 bytes for the header
@@ -19,6 +30,32 @@ MAX_USERNAME_SIZE = 255  # 2**8 - 1 bytes
 MAX_ROOM_NAME_SIZE = 255
 MAX_OPERATION_PAYLOAD_SIZE = 536870911  # 2**29 - 1 bytes
 TOKEN_SIZE = 32  # 32 bytes for secure token (up to 255 bytes)
+MAX_REQUEST_PAYLOAD_SIZE = 4096  # Server-side cap: create/join payloads are far smaller
+MAX_REQUEST_BODY_SIZE = MAX_ROOM_NAME_SIZE + MAX_REQUEST_PAYLOAD_SIZE
+RECV_CHUNK_SIZE = 64 * 1024  # Max bytes read per recv() call for a message body
+
+# Header: RoomNameSize(1) + Operation(1) + State(1) + OperationPayloadSize(29)
+_HEADER = struct.Struct(">BBB25xI")
+# Decoding keeps the 25 high payload-size bytes to check that they are zero
+_HEADER_FIELDS = struct.Struct(">BBB25sI")
+_SIZE_PADDING = bytes(25)
+
+
+def _json_dumps(payload: Any) -> bytes:
+    """Serialize a payload to UTF-8 JSON bytes, with orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass  # e.g. non-str keys, which the json module coerces
+    return json.dumps(payload).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse UTF-8 JSON bytes, with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
 
 
 # A custom protocol called The Chat Room Protocol (TCRP)
@@ -37,6 +74,16 @@ class TCRPState(IntEnum):
     COMPLETION = 2  # Server sends unique token
 
 
+# Raw header byte -> enum member (None for unknown codes), skipping IntEnum.__call__
+_OPERATION_TABLE = tuple(
+    TCRPOperation(i) if i in TCRPOperation._value2member_map_ else None
+    for i in range(256)
+)
+_STATE_TABLE = tuple(
+    TCRPState(i) if i in TCRPState._value2member_map_ else None for i in range(256)
+)
+
+
 class TCRPStatusCodes(IntEnum):
     """Status codes for server responses"""
 
@@ -50,9 +97,151 @@ class TCRPStatusCodes(IntEnum):
     UNAUTHORIZED = 7
 
 
+# Fixed-schema binary payloads start with this byte; JSON and text never do
+BINARY_PAYLOAD_TAG = 0x00
+_STR_SIZE = struct.Struct(">H")  # Length prefix for string fields
+_NONE_SIZE = 0xFFFF  # String length marking a None value
+_FIELD_STRUCTS = {
+    "u8": struct.Struct(">B"),
+    "u32": struct.Struct(">I"),
+    "bool": struct.Struct(">?"),
+}
+
+# Field layout of every known payload, keyed by (operation, state)
+_RESPONSE_FIELDS = (("status_code", "u8"), ("message", "str"))
+_PAYLOAD_SCHEMAS = {
+    (TCRPOperation.CREATE_ROOM, TCRPState.REQUEST): (
+        ("username", "str"),
+        ("password", "str"),
+    ),
+    (TCRPOperation.CREATE_ROOM, TCRPState.RESPONSE): _RESPONSE_FIELDS,
+    (TCRPOperation.CREATE_ROOM, TCRPState.COMPLETION): (
+        ("token", "str"),
+        ("host_username", "str"),
+        ("room_created", "bool"),
+    ),
+    (TCRPOperation.JOIN_ROOM, TCRPState.REQUEST): (
+        ("username", "str"),
+        ("password", "str"),
+    ),
+    (TCRPOperation.JOIN_ROOM, TCRPState.RESPONSE): _RESPONSE_FIELDS,
+    (TCRPOperation.JOIN_ROOM, TCRPState.COMPLETION): (
+        ("token", "str"),
+        ("host_username", "str"),
+        ("participant_count", "u32"),
+        ("room_joined", "bool"),
+    ),
+}
+
+
+def _pack_str(value: Optional[str]) -> Optional[bytes]:
+    """Length-prefixed UTF-8, or the None marker; None if value isn't a str."""
+    if value is None:
+        return _NONE_PREFIX
+    if not isinstance(value, str):
+        return None
+    encoded = value.encode("utf-8")
+    if len(encoded) >= _NONE_SIZE:
+        return None
+    return _STR_SIZE.pack(len(encoded)) + encoded
+
+
+def _make_int_packer(field: struct.Struct, is_bool: bool):
+    """Build a packer for one fixed-width field that rejects the wrong int kind."""
+    pack = field.pack
+
+    def packer(value: Any) -> Optional[bytes]:
+        if isinstance(value, bool) != is_bool or not isinstance(value, int):
+            return None
+        try:
+            return pack(value)
+        except struct.error:
+            return None
+
+    return packer
+
+
+_NONE_PREFIX = _STR_SIZE.pack(_NONE_SIZE)
+_FIELD_PACKERS = {
+    "str": _pack_str,
+    "u8": _make_int_packer(_FIELD_STRUCTS["u8"], False),
+    "u32": _make_int_packer(_FIELD_STRUCTS["u32"], False),
+    "bool": _make_int_packer(_FIELD_STRUCTS["bool"], True),
+}
+
+# Each schema resolved once into (name, packer) pairs
+_PAYLOAD_PACKERS = {
+    key: tuple((name, _FIELD_PACKERS[kind]) for name, kind in schema)
+    for key, schema in _PAYLOAD_SCHEMAS.items()
+}
+_TAG_BYTES = bytes((BINARY_PAYLOAD_TAG,))
+_JSON_START_BYTES = frozenset(b"{[")  # JSON payloads are objects (or arrays)
+
+
+def _pack_payload(
+    operation: TCRPOperation, state: TCRPState, payload: Dict[str, Any]
+) -> Optional[bytes]:
+    """
+    Pack a payload positionally using its (operation, state) schema.
+    Returns None when the payload doesn't fit the schema (caller falls back to JSON).
+    """
+    packers = _PAYLOAD_PACKERS.get((operation, state))
+    if packers is None or len(payload) != len(packers):
+        return None
+
+    parts = [_TAG_BYTES]
+    for name, packer in packers:
+        try:
+            packed = packer(payload[name])
+        except KeyError:
+            return None
+        if packed is None:
+            return None
+        parts.append(packed)
+
+    return b"".join(parts)
+
+
+def _unpack_payload(
+    operation: TCRPOperation, state: TCRPState, data: bytes
+) -> Dict[str, Any]:
+    """Unpack a binary payload (tag byte included) with its (operation, state) schema."""
+    schema = _PAYLOAD_SCHEMAS.get((operation, state))
+    if schema is None:
+        raise ValueError(
+            f"No binary payload schema for {operation.name}/{state.name}"
+        )
+
+    payload = {}
+    offset = 1  # Skip the tag byte
+    try:
+        for name, kind in schema:
+            if kind == "str":
+                (size,) = _STR_SIZE.unpack_from(data, offset)
+                offset += _STR_SIZE.size
+                if size == _NONE_SIZE:
+                    payload[name] = None
+                    continue
+                end = offset + size
+                if end > len(data):
+                    raise ValueError(f"Binary payload truncated in '{name}'")
+                payload[name] = data[offset:end].decode("utf-8")
+                offset = end
+            else:
+                field = _FIELD_STRUCTS[kind]
+                (payload[name],) = field.unpack_from(data, offset)
+                offset += field.size
+    except struct.error:
+        raise ValueError(f"Binary payload truncated in '{name}'")
+
+    return payload
+
+
 class TCRPMessage:
     """Represents a TCRP message with header and body"""
 
+    __slots__ = ("room_name", "operation", "state", "payload")
+
     def __init__(
         self,
         room_name: str,
@@ -63,15 +252,21 @@ class TCRPMessage:
         self.room_name = room_name
         self.operation = operation
         self.state = state
-        self.payload = payload or {}
+        self.payload = payload if payload is not None else {}
 
     def __repr__(self):
         return f"TCRPMessage(room_name={self.room_name}, operation={self.operation.name}, state={self.state.name})"
 
 
-def encode_tcrp_message(message: TCRPMessage) -> bytes:
+@functools.lru_cache(maxsize=4096)
+def _encode_name(name: str) -> bytes:
+    """UTF-8 bytes of a room name; the same few names recur in every message."""
+    return name.encode("utf-8")
+
+
+def encode_tcrp_message_iov(message: TCRPMessage) -> List[bytes]:
     """
-    Encode a TCRP message into bytes according to the protocol specification.
+    Encode a TCRP message as [header, room name, payload] for scatter-gather writes.
 
     Header (32 bytes): RoomNameSize (1 byte), Operation (1 byte), State (1 byte), OperationPayloadSize (29 bytes)
     Body: [RoomName(max 255 bytes), OperationPayload(max 536870911 bytes)]
@@ -80,23 +275,25 @@ def encode_tcrp_message(message: TCRPMessage) -> bytes:
         message: TCRPMessage to encode
 
     Returns:
-        bytes: Encoded TCRP message
+        List[bytes]: Header, room name and payload segments, in wire order
 
     Raises:
         ValueError: If message exceeds size limits
     """
     # Encode room name
-    room_name_bytes = message.room_name.encode("utf-8")
+    room_name_bytes = _encode_name(message.room_name)
     if len(room_name_bytes) > MAX_ROOM_NAME_SIZE:
         raise ValueError(
             f"Room name too long {len(room_name_bytes)} > {MAX_ROOM_NAME_SIZE}"
         )
 
-    # Encode payload as JSON string
-    if isinstance(message.payload, dict):
-        payload_bytes = json.dumps(message.payload).encode(
-            "utf-8"
-        )  # Convert to JSON string, then encode to bytes
+    # Encode known payloads positionally, anything else as a JSON string
+    if isinstance(message.payload, dict) and not message.payload:
+        payload_bytes = b""  # Decodes back to an empty payload
+    elif isinstance(message.payload, dict):
+        payload_bytes = _pack_payload(message.operation, message.state, message.payload)
+        if payload_bytes is None:
+            payload_bytes = _json_dumps(message.payload)  # JSON, as UTF-8 bytes
     elif isinstance(message.payload, str):
         payload_bytes = message.payload.encode("utf-8")  # Convert to bytes directory
     else:
@@ -116,18 +313,37 @@ def encode_tcrp_message(message: TCRPMessage) -> bytes:
     state = int(message.state.value)
     payload_size = len(payload_bytes)  # The number of bytes in the payload
 
-    # Pack header: 1 byte + 1 byte + 1 byte + 29 bytes for payload size
-    header = struct.pack(">BBB", room_name_size, operation, state)
+    # The 29-byte payload size is 25 zero bytes + a 4-byte big-endian int,
+    # since MAX_OPERATION_PAYLOAD_SIZE < 2**32
+    header = _HEADER.pack(room_name_size, operation, state, payload_size)
+
+    return [header, room_name_bytes, payload_bytes]
+
+
+def encode_tcrp_message(message: TCRPMessage) -> bytes:
+    """Encode a TCRP message into one contiguous bytes object."""
+    return b"".join(encode_tcrp_message_iov(message))
 
-    # 29-byte big-endian payload size (Produces a 29-byte representation with leading zeros.)
-    # Example: 5 becomes 28 zero bytes + \x05.
-    payload_size_bytes = payload_size.to_bytes(29, "big")
-    header += payload_size_bytes  # Header is now exactly 32 bytes
 
-    body = room_name_bytes + payload_bytes
+def send_tcrp_message(sock: socket.socket, *messages: TCRPMessage):
+    """Send one or more TCRP messages with one sendmsg call, without joining them."""
+    segments = [
+        segment for message in messages for segment in encode_tcrp_message_iov(message)
+    ]
+    _send_segments(sock, segments)
 
-    # Combine header and body
-    return header + body
+
+def _send_segments(sock: socket.socket, segments: List[bytes]):
+    """Write segments with one sendmsg call, finishing any short write with sendall."""
+    if not hasattr(sock, "sendmsg"):
+        # Portable fallback (e.g. Windows, SSL sockets): one joined write
+        sock.sendall(b"".join(segments))
+        return
+    sent = sock.sendmsg(segments)
+    total = sum(len(segment) for segment in segments)
+    if sent < total:
+        # Short write on a full socket buffer: send the rest the simple way
+        sock.sendall(memoryview(b"".join(segments))[sent:])
 
 
 def decode_tcrp_message(data: bytes) -> TCRPMessage:
@@ -147,18 +363,25 @@ def decode_tcrp_message(data: bytes) -> TCRPMessage:
     if len(data) < HEADER_SIZE:
         raise ValueError(f"Message too short: {len(data)} < {HEADER_SIZE}")
 
-    # Unpack header (32 bytes)
-    header = data[:HEADER_SIZE]
-
-    # Unpack header components
+    # Unpack header (32 bytes) in one call
     # (e.g., b'\x05\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x05roomaaaaa')
-    room_name_size = header[0]
-    operation = TCRPOperation(header[1])  # e.g., <TCRPOperation.CREATE_ROOM: 1>
-    state = TCRPState(header[2])  # e.g., <TCRPState.REQUEST: 0>
-
-    # Extract payload size bytes and then converts to integer
-    payload_size_bytes = header[3:32]
-    payload_size = int.from_bytes(payload_size_bytes, "big")
+    room_name_size, op_code, state_code, padding, payload_size = (
+        _HEADER_FIELDS.unpack_from(data)
+    )
+    operation = _OPERATION_TABLE[op_code]  # e.g., <TCRPOperation.CREATE_ROOM: 1>
+    if operation is None:
+        raise ValueError(f"Unknown operation: {op_code}")
+    state = _STATE_TABLE[state_code]  # e.g., <TCRPState.REQUEST: 0>
+    if state is None:
+        raise ValueError(f"Unknown state: {state_code}")
+
+    # The 29-byte payload size never needs more than its low 4 bytes
+    if padding != _SIZE_PADDING:
+        raise ValueError("Payload size exceeds 32 bits")
+    if payload_size > MAX_OPERATION_PAYLOAD_SIZE:
+        raise ValueError(
+            f"Payload too long {payload_size} > {MAX_OPERATION_PAYLOAD_SIZE}"
+        )
 
     # Validate message length
     expected_length = HEADER_SIZE + room_name_size + payload_size
@@ -175,11 +398,17 @@ def decode_tcrp_message(data: bytes) -> TCRPMessage:
 
     if payload_size > 0:
         payload_bytes = data[room_name_end:payload_end]
-        try:
-            # Try to decode as JSON first
-            payload = json.loads(payload_bytes.decode("utf-8"))
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            # If JSON fails, try to decode as string
+        first_byte = payload_bytes[0]
+        if first_byte == BINARY_PAYLOAD_TAG:
+            payload = _unpack_payload(operation, state, payload_bytes)
+        elif first_byte in _JSON_START_BYTES:
+            try:
+                # Looks like a JSON object or array
+                payload = _json_loads(payload_bytes)
+            except ValueError:  # Covers JSONDecodeError and UnicodeDecodeError
+                payload = payload_bytes.decode("utf-8")
+        else:
+            # Plain text: skip the JSON attempt and its exception
             payload = payload_bytes.decode("utf-8")
     else:
         payload = {}
@@ -187,6 +416,90 @@ def decode_tcrp_message(data: bytes) -> TCRPMessage:
     return TCRPMessage(room_name, operation, state, payload)
 
 
+def _arm_deadline(sock: socket.socket, deadline: Optional[float]):
+    """Limit the next blocking call on sock to what is left before deadline."""
+    if deadline is None:
+        return
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout("Transaction deadline exceeded")
+    sock.settimeout(remaining)
+
+
+def _recv_into(
+    sock: socket.socket, view: memoryview, deadline: Optional[float] = None
+) -> int:
+    """Fill view from sock; returns bytes read, short only if the peer closed."""
+    received = 0
+    while received < len(view):
+        _arm_deadline(sock, deadline)
+        nbytes = sock.recv_into(view[received:])
+        if nbytes == 0:
+            break
+        received += nbytes
+    return received
+
+
+def _recv_extend(
+    sock: socket.socket, buffer: bytearray, size: int, deadline: Optional[float] = None
+) -> int:
+    """Append up to size bytes from sock to buffer, growing it only as data arrives"""
+    remaining = size
+    while remaining:
+        _arm_deadline(sock, deadline)
+        chunk = sock.recv(min(remaining, RECV_CHUNK_SIZE))
+        if not chunk:
+            break
+        buffer += chunk
+        remaining -= len(chunk)
+    return size - remaining
+
+
+def recv_tcrp_message(
+    sock: socket.socket,
+    max_payload_size: int = MAX_OPERATION_PAYLOAD_SIZE,
+    max_body_size: int = MAX_ROOM_NAME_SIZE + MAX_OPERATION_PAYLOAD_SIZE,
+    deadline: Optional[float] = None,
+) -> Optional[TCRPMessage]:
+    """
+    Read exactly one TCRP message from a stream socket.
+
+    Messages whose header announces more than max_payload_size payload bytes,
+    or more than max_body_size room name plus payload bytes, are rejected
+    before any of the body is read. deadline (time.monotonic()) bounds the
+    whole read, however slowly the peer trickles bytes; it changes sock's timeout.
+
+    Returns:
+        TCRPMessage, or None if the peer closed before sending a header
+
+    Raises:
+        ValueError: If the header is invalid or the peer closed mid-message
+        socket.timeout: If the deadline passes first
+    """
+    buffer = bytearray(HEADER_SIZE)
+    received = _recv_into(sock, memoryview(buffer), deadline)
+    if received == 0:
+        return None
+    if received < HEADER_SIZE:
+        raise ValueError(f"Message too short: {received} < {HEADER_SIZE}")
+
+    # Size the body from the header before reading it
+    room_name_size, _, _, padding, payload_size = _HEADER_FIELDS.unpack_from(buffer)
+    if padding != _SIZE_PADDING or payload_size > MAX_OPERATION_PAYLOAD_SIZE:
+        raise ValueError("Payload too long")
+    body_size = room_name_size + payload_size
+    if payload_size > max_payload_size or body_size > max_body_size:
+        raise ValueError(f"Message too long: {body_size} body bytes")
+    # The header is untrusted: don't allocate the body before it arrives
+    received = _recv_extend(sock, buffer, body_size, deadline)
+    if received < body_size:
+        raise ValueError(
+            f"Message incomplete: {HEADER_SIZE + received} < {HEADER_SIZE + body_size}"
+        )
+
+    return decode_tcrp_message(buffer)
+
+
 def create_room_request(
     username: str, room_name: str, password: str = None
 ) -> TCRPMessage:
@@ -247,15 +560,84 @@ def join_room_complete(
     )
 
 
+@functools.lru_cache(maxsize=64)
+def _response_payload(
+    operation: TCRPOperation, status_code: TCRPStatusCodes, message: str
+) -> bytes:
+    """Encoded RESPONSE payload; it doesn't depend on the room, so it is shared."""
+    payload = {"status_code": int(status_code), "message": message}
+    response = TCRPMessage("", operation, TCRPState.RESPONSE, payload)
+    return encode_tcrp_message_iov(response)[2]
+
+
+def send_tcrp_response(
+    sock: socket.socket,
+    operation: TCRPOperation,
+    room_name: str,
+    status_code: TCRPStatusCodes,
+    message: str = "",
+):
+    """Send a RESPONSE message, reusing the encoded payload for repeated statuses."""
+    room_name_bytes = _encode_name(room_name)
+    if len(room_name_bytes) > MAX_ROOM_NAME_SIZE:
+        raise ValueError(
+            f"Room name too long {len(room_name_bytes)} > {MAX_ROOM_NAME_SIZE}"
+        )
+    payload_bytes = _response_payload(operation, status_code, message)
+    header = _HEADER.pack(
+        len(room_name_bytes), operation, TCRPState.RESPONSE, len(payload_bytes)
+    )
+    _send_segments(sock, [header, room_name_bytes, payload_bytes])
+
+
+TOKEN_BATCH = 256  # Tokens drawn from the OS per urandom call
+
+
+class TokenPool:
+    """Hex tokens pregenerated in bulk, so most requests skip the urandom syscall"""
+
+    def __init__(self, batch: int = TOKEN_BATCH):
+        self._batch = batch
+        self._tokens = collections.deque()
+
+    def _refill(self):
+        """Draw one batch of random bytes and slice it into tokens."""
+        random_bytes = os.urandom(TOKEN_SIZE * self._batch)
+        hex_bytes = binascii.hexlify(random_bytes).decode("ascii")
+        step = TOKEN_SIZE * 2
+        self._tokens.extend(
+            hex_bytes[i : i + step] for i in range(0, len(hex_bytes), step)
+        )
+
+    def get(self) -> str:
+        """Pop a fresh token; deque.popleft is atomic, so threads never share one."""
+        while True:
+            try:
+                return self._tokens.popleft()
+            except IndexError:
+                self._refill()
+
+
+_TOKEN_POOL = TokenPool()
+
+
 def generate_secure_token() -> str:
     """Generate a cryptographically secure token for room authentication"""
     # output is something like:'4d934e4815cd59f9964829e19c5c4c6404316d70a5f7ffe607538dd29a7038c5' which is 32 bytes (each byte is 2 hex chars)
-    return secrets.token_hex(TOKEN_SIZE)
+    return _TOKEN_POOL.get()
 
 
+# Any ASCII control character; UTF-8 continuation bytes are all >= 0x80
+_CONTROL_CHARS = re.compile(rb"[\x00-\x1f]")
+
+
+@functools.lru_cache(maxsize=4096)
 def validate_room_name(room_name: str) -> bool:
     """Validate room name according to protocol constraints"""
-    if not room_name or len(room_name.encode("utf-8")) > MAX_ROOM_NAME_SIZE:
+    if not room_name:
+        return False
+    room_name_bytes = room_name.encode("utf-8")
+    if len(room_name_bytes) > MAX_ROOM_NAME_SIZE:
         return False
 
     # Additional validation rules
@@ -263,25 +645,31 @@ def validate_room_name(room_name: str) -> bool:
         return False
 
     # No control characters
-    if any(ord(char) < 32 for char in room_name):
-        return False
-
-    return True
+    return _CONTROL_CHARS.search(room_name_bytes) is None
 
 
 def validate_username(username: str) -> bool:
     """Validate username according to protocol constraints"""
-    if not username or len(username.encode("utf-8")) > MAX_USERNAME_SIZE:
+    # Payloads are decoded JSON: check the type before the cache hashes it
+    if not isinstance(username, str):
         return False
+    return _validate_username_str(username)
 
-    if username.strip() != username:  # No leading/trailing whitespace
+
+@functools.lru_cache(maxsize=4096)
+def _validate_username_str(username: str) -> bool:
+    """Validate a str username; cached, since the same names keep rejoining"""
+    if not username:
+        return False
+    username_bytes = username.encode("utf-8")
+    if len(username_bytes) > MAX_USERNAME_SIZE:
         return False
 
-    # No control characters
-    if any(ord(char) < 32 for char in username):
+    if username.strip() != username:  # No leading/trailing whitespace
         return False
 
-    return True
+    # No control characters
+    return _CONTROL_CHARS.search(username_bytes) is None
 
 
 class TokenManager:
@@ -332,6 +720,9 @@ class TokenManager:
 # Test functions for development
 def test_protocol():
     """Test basic protocol encoding/decoding"""
+    import tracemalloc  # Only the buffering check below needs it
+    import types  # SimpleNamespace stands in for a socket without sendmsg
+
     print("🧪 Testing TCRP Protocol...")
 
     # Test room creation request
@@ -348,6 +739,102 @@ def test_protocol():
     assert decoded.operation == TCRPOperation.CREATE_ROOM
     assert decoded.state == TCRPState.REQUEST
     assert decoded.payload["username"] == "Alice"
+    assert encoded[HEADER_SIZE + len("MyRoom")] == BINARY_PAYLOAD_TAG
+
+    # Known payloads round-trip through the binary schema, including None
+    completion = join_room_complete("MyRoom", generate_secure_token(), "Alice", 3)
+    decoded = decode_tcrp_message(encode_tcrp_message(completion))
+    assert decoded.payload == completion.payload
+    decoded = decode_tcrp_message(encode_tcrp_message(join_room_request("Bob", "MyRoom")))
+    assert decoded.payload["password"] is None
+
+    # Text payloads decode as text, even when they look like JSON scalars
+    for text in ("hello", "42", "{not json"):
+        message = TCRPMessage("MyRoom", TCRPOperation.JOIN_ROOM, TCRPState.REQUEST, text)
+        assert decode_tcrp_message(encode_tcrp_message(message)).payload == text
+
+    # Payloads outside the schema still travel as JSON
+    custom = TCRPMessage("MyRoom", TCRPOperation.JOIN_ROOM, TCRPState.REQUEST, {"x": [1]})
+    assert decode_tcrp_message(encode_tcrp_message(custom)).payload == {"x": [1]}
+
+    assert validate_username("Alice") and validate_room_name("Café ☕")
+    assert not validate_username("Al\tice") and not validate_room_name(" MyRoom")
+    assert not any(map(validate_username, (None, 5, ["a"], {}, {"a": 1})))
+
+    # Scatter-gather segments join to the contiguous encoding
+    segments = encode_tcrp_message_iov(completion)
+    assert len(segments) == 3 and b"".join(segments) == encode_tcrp_message(completion)
+    left, right = socket.socketpair()
+
+    # Cached responses match the helper-built ones byte for byte
+    send_tcrp_response(
+        left, TCRPOperation.JOIN_ROOM, "MyRoom", TCRPStatusCodes.UNAUTHORIZED, "No"
+    )
+    cached = join_room_response("MyRoom", TCRPStatusCodes.UNAUTHORIZED, "No")
+    assert right.recv(1024) == encode_tcrp_message(cached)
+
+    send_tcrp_message(left, request, completion)
+    # The reader frames coalesced messages by their headers
+    assert recv_tcrp_message(right).payload == request.payload
+    assert recv_tcrp_message(right).payload == completion.payload
+
+    # Sockets without sendmsg fall back to one sendall of the joined segments
+    sendall_only = types.SimpleNamespace(sendall=left.sendall)
+    send_tcrp_message(sendall_only, request)
+    assert recv_tcrp_message(right).payload == request.payload
+    left.close()
+    assert recv_tcrp_message(right) is None
+    right.close()
+
+    # Messages without a payload get their own dict and send no payload bytes
+    empty = TCRPMessage("MyRoom", TCRPOperation.JOIN_ROOM, TCRPState.REQUEST)
+    assert len(encode_tcrp_message(empty)) == HEADER_SIZE + len("MyRoom")
+    decoded = decode_tcrp_message(encode_tcrp_message(empty))
+    assert type(decoded.payload) is dict and decoded.payload == {}
+    empty.payload["note"] = "mutable"  # Defaults are never shared
+    fresh = TCRPMessage("MyRoom", TCRPOperation.JOIN_ROOM, TCRPState.REQUEST)
+    assert fresh.payload == {}
+    assert json.loads(json.dumps(empty.payload)) == {"note": "mutable"}
+
+    # Pooled tokens keep the secrets.token_hex(TOKEN_SIZE) shape and never repeat
+    tokens = {generate_secure_token() for _ in range(TOKEN_BATCH + 1)}
+    assert len(tokens) == TOKEN_BATCH + 1
+    assert all(len(t) == TOKEN_SIZE * 2 for t in tokens)
+
+    # Payload sizes that don't fit the low 4 bytes are rejected
+    try:
+        decode_tcrp_message(b"\x00\x01\x00\x01" + bytes(28))
+        assert False, "oversized payload size accepted"
+    except ValueError:
+        pass
+
+    # Sizes over the protocol limit are rejected before the length check
+    try:
+        decode_tcrp_message(b"\x00\x01\x00" + bytes(25) + b"\xff\xff\xff\xff")
+        assert False, "payload over MAX_OPERATION_PAYLOAD_SIZE accepted"
+    except ValueError as e:
+        assert "too long" in str(e)
+
+    # Oversized requests are refused from the header alone, without buffering
+    left, right = socket.socketpair()
+    left.sendall(_HEADER.pack(0, 1, 0, MAX_REQUEST_PAYLOAD_SIZE + 1))
+    tracemalloc.start()
+    try:
+        recv_tcrp_message(right, MAX_REQUEST_PAYLOAD_SIZE, MAX_REQUEST_BODY_SIZE)
+        assert False, "payload over MAX_REQUEST_PAYLOAD_SIZE accepted"
+    except ValueError as e:
+        assert "too long" in str(e)
+    assert tracemalloc.get_traced_memory()[1] < RECV_CHUNK_SIZE
+    tracemalloc.stop()
+    left.close()
+    right.close()
+
+    # Unknown operation codes are rejected
+    try:
+        decode_tcrp_message(b"\x00\x09\x00" + bytes(29))
+        assert False, "unknown operation accepted"
+    except ValueError:
+        pass
 
     print("✅ TCRP Protocol test passed!")
 
@@ -4,29 +4,40 @@ TCP Server for Stage 2 Chat Room Management
 Handles room creation and joining via TCRP protocol
 """
 
+import logging
+import os
 import socket
+import sys
 import threading
 import time
-from typing import Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 
 from room_manager import Room
 from tcp_protocol import (
+    MAX_REQUEST_BODY_SIZE,
+    MAX_REQUEST_PAYLOAD_SIZE,
     TCRPMessage,
     TCRPOperation,
-    TCRPState,
     TCRPStatusCodes,
     TokenManager,
     create_room_complete,
     create_room_response,
-    decode_tcrp_message,
-    encode_tcrp_message,
     join_room_complete,
-    join_room_request,
     join_room_response,
+    recv_tcrp_message,
+    send_tcrp_message,
+    send_tcrp_response,
     validate_room_name,
     validate_username,
 )
 
+log = logging.getLogger(__name__)
+
+CLIENT_TIMEOUT_SECONDS = 5.0  # Max time for a client's whole transaction
+TCP_WORKERS = (os.cpu_count() or 1) * 4  # Threads handling transactions
+MAX_PENDING_CLIENTS = TCP_WORKERS * 4  # Queued + running; beyond this, refuse
+
 
 class TCRPServer:
     """TCP server for chat room management using TCRP protocol"""
@@ -40,13 +51,25 @@ class TCRPServer:
         # Core components
         self.rooms = {}  # {room_name: {host: username, clients: {username: client_ip}}}
         self.token_manager = TokenManager()
+        self._rooms_lock = threading.Lock()  # Guards changes to self.rooms
         self.running = False
+        self._handlers = {
+            TCRPOperation.CREATE_ROOM: self.handle_create_room,
+            TCRPOperation.JOIN_ROOM: self.handle_join_room,
+        }
+
+        # Reused worker threads: one transaction is far cheaper than a new thread
+        self.pool = ThreadPoolExecutor(
+            max_workers=TCP_WORKERS, thread_name_prefix="tcrp"
+        )
+        self._pending = threading.BoundedSemaphore(MAX_PENDING_CLIENTS)
 
     def start(self):
         """Start the TCP server"""
         try:
             self.sock.bind((self.host, self.port))
             self.sock.listen(5)
+            self.port = self.sock.getsockname()[1]
             self.running = True
             print(f"🚀 TCP Room Server started on {self.host}:{self.port}")
             print("\n👥 Ready to handle room creation and joining requests...")
@@ -54,14 +77,18 @@ class TCRPServer:
             while self.running:
                 try:
                     client_sock, client_addr = self.sock.accept()
-                    print(f"\n🔗 New client connected: {client_addr}")
+                    # Keep the executor queue bounded: refuse rather than pile up
+                    if not self._pending.acquire(blocking=False):
+                        print(f"\n⚠️ Too many pending clients, refusing {client_addr}")
+                        client_sock.close()
+                        continue
 
-                    # Handle each client in a separate thread
-                    client_thread = threading.Thread(
-                        target=self._handle_client, args=(client_sock, client_addr)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
+                    # Small request/response exchanges: don't let Nagle delay them
+                    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    log.debug("🔗 New client connected: %s", client_addr)
+
+                    # Handle each client on a pooled worker thread
+                    self.pool.submit(self._handle_client, client_sock, client_addr)
 
                 except Exception as e:
                     if self.running:
@@ -77,28 +104,32 @@ class TCRPServer:
     def _handle_client(self, client_sock: socket.socket, client_addr: tuple):
         """Handle individual client TCRP transactions"""
         try:
-            # Receive TCRP message
-            data = client_sock.recv(4096)  # Adjust size as needed
-            if not data:
+            # Bound how long a slow client can hold a worker, for the whole request
+            deadline = time.monotonic() + CLIENT_TIMEOUT_SECONDS
+            message = recv_tcrp_message(
+                client_sock, MAX_REQUEST_PAYLOAD_SIZE, MAX_REQUEST_BODY_SIZE, deadline
+            )
+            if message is None:
                 return
+            client_sock.settimeout(CLIENT_TIMEOUT_SECONDS)  # For the reply
 
-            # Decode TCRP message
-            message = decode_tcrp_message(data)
-            print(
-                f"\n📨 Received {message.operation.name} request for room '{message.room_name}'"
+            log.debug(
+                "📨 Received %s request for room '%s'",
+                message.operation.name,
+                message.room_name,
             )
 
             # Route to appropriate handler based on operation
-            if message.operation == TCRPOperation.CREATE_ROOM:
-                self.handle_create_room(client_sock, client_addr, message)
-            elif message.operation == TCRPOperation.JOIN_ROOM:
-                self.handle_join_room(client_sock, client_addr, message)
-            else:
+            handler = self._handlers.get(message.operation)
+            if handler is None:
                 print(f"\n❓ Unknown operation: {message.operation.name}")
+            else:
+                handler(client_sock, client_addr, message)
         except Exception as e:
             print(f"\n❌ Error handling client {client_addr}: {e}")
         finally:
             client_sock.close()
+            self._pending.release()
 
     def handle_create_room(
         self, client_sock: socket.socket, client_addr: tuple, message: TCRPMessage
@@ -106,63 +137,56 @@ class TCRPServer:
         """Handle room creation request"""
         try:
             # Extract request data
+            room_name = message.room_name
             username = message.payload["username"]
+            if isinstance(username, str):
+                username = sys.intern(username)  # Stored per room
             password = message.payload["password"]
-            room_name = message.room_name
             client_ip = client_addr[0]
 
             # RESPONSE phase
-            result, result_message = self.create_room(
+            result, status_code, result_message, room = self.create_room(
                 room_name, username, client_ip, password
             )
 
-            if result:
-                response = create_room_response(
-                    room_name, TCRPStatusCodes.SUCCESS, result_message
+            if not result:
+                # Send response
+                send_tcrp_response(
+                    client_sock,
+                    TCRPOperation.CREATE_ROOM,
+                    room_name,
+                    status_code,
+                    result_message,
                 )
-            else:
-                # Determine appropriate status code
-                if "already exists" in result_message:
-                    status_code = TCRPStatusCodes.ROOM_EXISTS
-                elif "Invalid" in result_message:
-                    status_code = (
-                        TCRPStatusCodes.INVALID_USERNAME
-                        if "username" in result_message
-                        else TCRPStatusCodes.INVALID_NAME
-                    )
-                else:
-                    status_code = TCRPStatusCodes.SERVER_ERROR
-
-                response = create_room_response(room_name, status_code, result_message)
-
-            # Send response
-            client_sock.send(encode_tcrp_message(response))
+                return
 
             # COMPLETION phase (only if successful)
-            if result:
-                # Generate token for host
-                token = self.token_manager.create_token(room_name, username, client_ip)
+            if result and room:
+                response = create_room_response(room_name, status_code, result_message)
 
-                # Add host to room
-                room = self.rooms[room_name]
-                room.add_participant(token, username, client_ip)
+                # The host was registered, with a token, before the room was published
+                token = room.host_token
 
-                # Send completion with token
+                # Send response and completion with token in one write
                 completion = create_room_complete(room_name, token, username)
-                client_sock.send(encode_tcrp_message(completion))
+                send_tcrp_message(client_sock, response, completion)
 
                 print(
-                    f"\n✅ Room '{room_name}' crated successfully, token issued to {username}"
+                    f"\n✅ Room '{room_name}' created successfully, "
+                    f"token issued to {username}"
                 )
 
         except Exception as e:
             print(f"❌ Error in create_room handler: {e}")
 
             # Send error response
-            error_response = create_room_response(
-                room_name, TCRPStatusCodes.SERVER_ERROR, "Internal server error"
+            send_tcrp_response(
+                client_sock,
+                TCRPOperation.CREATE_ROOM,
+                room_name,
+                TCRPStatusCodes.SERVER_ERROR,
+                "Internal server error",
             )
-            client_sock.send(encode_tcrp_message(error_response))
 
     def handle_join_room(
         self, client_sock: socket.socket, client_addr: tuple, message: TCRPMessage
@@ -170,52 +194,44 @@ class TCRPServer:
         """Handle room joining request"""
         try:
             # Extract request data
+            room_name = message.room_name
             username = message.payload["username"]
+            if isinstance(username, str):
+                username = sys.intern(username)  # Stored per room
             password = message.payload["password"]
-            room_name = message.room_name
             client_ip = client_addr[0]
 
             # RESPONSE PHASE
-            result, result_message, room = self.join_room(
+            result, status_code, result_message, room = self.join_room(
                 room_name, username, client_ip, password
             )
 
-            if result:
-                response = join_room_response(
-                    room_name, TCRPStatusCodes.SUCCESS, result_message
+            if not result:
+                # Send response
+                send_tcrp_response(
+                    client_sock,
+                    TCRPOperation.JOIN_ROOM,
+                    room_name,
+                    status_code,
+                    result_message,
                 )
-            else:
-                # Determine appropriate status code
-                if (
-                    "not found" in result_message
-                    or "no longer active" in result_message
-                ):
-                    status_code = TCRPStatusCodes.ROOM_NOT_FOUND
-                elif "password" in result_message:
-                    status_code = TCRPStatusCodes.UNAUTHORIZED
-                elif "Invalid" in result_message:
-                    status_code = TCRPStatusCodes.INVALID_USERNAME
-                else:
-                    status_code = TCRPStatusCodes.SERVER_ERROR
-
-                response = join_room_response(room_name, status_code, result_message)
-
-            # Send response
-            client_sock.send(encode_tcrp_message(response))
+                return
 
             # COMPLETION phase (only if successful)
             if result and room:
+                response = join_room_response(room_name, status_code, result_message)
+
                 # Generate token for participant
                 token = self.token_manager.create_token(room_name, username, client_ip)
 
                 # Add participant to room
                 room.add_participant(token, username, client_ip)
 
-                # Send completion with token
+                # Send response and completion with token in one write
                 completion = join_room_complete(
                     room_name, token, room.host_username, room.get_participant_count()
                 )
-                client_sock.send(encode_tcrp_message(completion))
+                send_tcrp_message(client_sock, response, completion)
 
                 print(
                     f"✅ {username} joined room '{room_name}' successfully, token issued"
@@ -224,78 +240,102 @@ class TCRPServer:
         except Exception as e:
             print(f"❌ Error in join_room handler: {e}")
             # Send error response
-            error_response = join_room_response(
-                room_name, TCRPStatusCodes.SERVER_ERROR, "Internal server error"
+            send_tcrp_response(
+                client_sock,
+                TCRPOperation.JOIN_ROOM,
+                room_name,
+                TCRPStatusCodes.SERVER_ERROR,
+                "Internal server error",
             )
-            client_sock.send(encode_tcrp_message(error_response))
 
     def create_room(
         self, room_name: str, host_username: str, host_ip: str, password: str = None
-    ) -> Tuple[bool, str]:
-        """Create a new room"""
+    ) -> Tuple[bool, TCRPStatusCodes, str, Optional[Room]]:
+        """Create a new room, with its host already registered"""
         # Validate inputs based on protocol constraints
         if not validate_room_name(room_name):
-            return False, "Invalid room name"
+            return False, TCRPStatusCodes.INVALID_NAME, "Invalid room name", None
 
         if not validate_username(host_username):
-            return False, "Invalid username"
-
-        # Check if room already exists
-        if room_name in self.rooms:
-            return False, "Room already exists"
+            return False, TCRPStatusCodes.INVALID_USERNAME, "Invalid username", None
 
-        # Create new room
+        # Create new room and add its host before anyone else can see it: a room
+        # without an active host looks dead to join_room and cleanup_inactive_rooms
         new_room = Room(room_name, host_username, host_ip, password)
-
-        # Add room to rooms dictionary
-        self.rooms[room_name] = new_room
+        token = self.token_manager.create_token(room_name, host_username, host_ip)
+        new_room.add_participant(token, host_username, host_ip)
+
+        # Check and insert together, so two hosts can't both create the same room
+        with self._rooms_lock:
+            exists = room_name in self.rooms
+            if not exists:
+                self.rooms[room_name] = new_room
+        if exists:
+            self.token_manager.remove_token(token)
+            return False, TCRPStatusCodes.ROOM_EXISTS, "Room already exists", None
 
         print(f"🏠 Room '{room_name}' created by {host_username}")
-        return True, "Room creation approved"
+        return True, TCRPStatusCodes.SUCCESS, "Room creation approved", new_room
 
     def join_room(
         self, room_name: str, username: str, client_ip: str, password: str = None
-    ) -> Tuple[bool, str, Optional[Room]]:
+    ) -> Tuple[bool, TCRPStatusCodes, str, Optional[Room]]:
         """Join an existing room"""
         # Validate inputs based on protocol constraints
         if not validate_username(username):
-            return False, "Invalid username", None
-
-        # Check if room exists
-        if room_name not in self.rooms:
-            return False, "Room does not exist", None
-
-        # Get room
-        room = self.rooms[room_name]
+            return False, TCRPStatusCodes.INVALID_USERNAME, "Invalid username", None
+
+        # Get room (a single lookup, in case it is removed concurrently)
+        room = self.rooms.get(room_name)
+        if room is None:
+            return (
+                False,
+                TCRPStatusCodes.ROOM_NOT_FOUND,
+                "Room does not exist",
+                None,
+            )
 
         # Check password
         if not room.validate_password(password):
-            return False, "Incorrect password", None
+            return False, TCRPStatusCodes.UNAUTHORIZED, "Incorrect password", None
 
         # Check if host is still active
         if not room.is_host_active():
-            del self.rooms[room_name]
-            return False, "Room is no longer active", None
+            with self._rooms_lock:
+                if self.rooms.get(room_name) is room:
+                    del self.rooms[room_name]
+            return (
+                False,
+                TCRPStatusCodes.ROOM_NOT_FOUND,
+                "Room is no longer active",
+                None,
+            )
 
         print(f"🚪 {username} joined room '{room_name}'")
-        return True, "Join room successful", room
+        return True, TCRPStatusCodes.SUCCESS, "Join room successful", room
 
     def cleanup_inactive_rooms(self):
         """Remove rooms where host has disconnected"""
-        inactive_rooms = []
-        for room_name, room in self.rooms.items():
-            if not room.is_host_active():
-                inactive_rooms.append(room_name)
-
-        for room_name in inactive_rooms:
-            print(f"🗑️ Removing inactive room: '{room_name}'")
-            del self.rooms[room_name]
+        # Scan a snapshot: handler threads may add or remove rooms meanwhile
+        inactive_rooms = [
+            room_name
+            for room_name, room in list(self.rooms.items())
+            if not room.is_host_active()
+        ]
+
+        with self._rooms_lock:
+            for room_name in inactive_rooms:
+                room = self.rooms.get(room_name)
+                if room is not None and not room.is_host_active():
+                    print(f"🗑️ Removing inactive room: '{room_name}'")
+                    del self.rooms[room_name]
 
     def stop(self):
         """Stop the TCP server"""
         self.running = False
         if hasattr(self, "sock"):
             self.sock.close()
+        self.pool.shutdown(wait=False)
         print("\n👋 Server shutting down...")
 
 
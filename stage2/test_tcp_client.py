@@ -20,13 +20,11 @@ def test_room_operations():
     create_request = create_room_request("Alice", "TestRoom", "secret123")
     sock1.send(encode_tcrp_message(create_request))
 
-    # Receive response and completion
-    response_data = sock1.recv(4096)
-    response = decode_tcrp_message(response_data)
+    # Receive response and completion (they may arrive in one segment)
+    response = recv_tcrp_message(sock1)
     print(f"Response: {response.payload}")
 
-    completion_data = sock1.recv(4096)
-    completion = decode_tcrp_message(completion_data)
+    completion = recv_tcrp_message(sock1)
     print(f"Completion: {completion.payload}")
 
     sock1.close()
@@ -39,13 +37,11 @@ def test_room_operations():
     join_request = join_room_request("Bob", "TestRoom", "secret123")
     sock2.send(encode_tcrp_message(join_request))
 
-    # Receive response and completion
-    response_data = sock2.recv(4096)
-    response = decode_tcrp_message(response_data)
+    # Receive response and completion (they may arrive in one segment)
+    response = recv_tcrp_message(sock2)
     print(f"Response: {response.payload}")
 
-    completion_data = sock2.recv(4096)
-    completion = decode_tcrp_message(completion_data)
+    completion = recv_tcrp_message(sock2)
     print(f"Completion: {completion.payload}")
 
     sock2.close()
@@ -19,6 +19,11 @@ MAX_MESSAGE_SIZE = (
     MAX_PACKET_SIZE_CLIENT_TO_SERVER - HEADER_SIZE - MAX_ROOM_NAME_SIZE - MAX_TOKEN_SIZE
 )
 
+# Packet headers, compiled once
+_CLIENT_HEADER = struct.Struct("BB")  # RoomNameSize(1) | TokenSize(1)
+_SERVER_HEADER = struct.Struct("BBB")  # MsgType(1) | UsernameSize(1) | MessageSize(1)
+SERVER_HEADER_SIZE = _SERVER_HEADER.size
+
 # Server-to-client Message Types
 MSG_TYPE_CHAT = 1
 MSG_TYPE_SYSTEM = 2
@@ -62,30 +67,35 @@ def encode_udp_message(room_name: str, token: str, message: str) -> bytes:
     token_bytes = token.encode("utf-8")
     message_bytes = message.encode("utf-8")
 
-    # Validate sizes
-    if len(room_name_bytes) > MAX_ROOM_NAME_SIZE:
-        raise ValueError(
-            f"Room name too long: {len(room_name_bytes)} > {MAX_ROOM_NAME_SIZE}"
-        )
-    if len(token_bytes) > MAX_TOKEN_SIZE:
-        raise ValueError(f"Token too long: {len(token_bytes)} > {MAX_TOKEN_SIZE}")
-
-    # Calculate total packet size
-    total_packet_size = (
-        HEADER_SIZE + len(room_name_bytes) + len(token_bytes) + len(message_bytes)
-    )
-    if total_packet_size > MAX_PACKET_SIZE_CLIENT_TO_SERVER:
+    room_name_size = len(room_name_bytes)
+    token_size = len(token_bytes)
+    total_packet_size = HEADER_SIZE + room_name_size + token_size + len(message_bytes)
+
+    # Both fields share a one-byte limit: one OR tests them together, and the
+    # slow path below only runs to name the offending field
+    if (room_name_size | token_size) > 0xFF or (
+        total_packet_size > MAX_PACKET_SIZE_CLIENT_TO_SERVER
+    ):
+        if room_name_size > MAX_ROOM_NAME_SIZE:
+            raise ValueError(
+                f"Room name too long: {room_name_size} > {MAX_ROOM_NAME_SIZE}"
+            )
+        if token_size > MAX_TOKEN_SIZE:
+            raise ValueError(f"Token too long: {token_size} > {MAX_TOKEN_SIZE}")
         raise ValueError(
             f"Packet too large: {total_packet_size} > {MAX_PACKET_SIZE_CLIENT_TO_SERVER}"
         )
 
-    # Packet header: RoomNameSize(1) + TokenSize(1)
-    header = struct.pack("BB", len(room_name_bytes), len(token_bytes))
+    # Build header + body in one buffer
+    packet = bytearray(total_packet_size)
+    _CLIENT_HEADER.pack_into(packet, 0, room_name_size, token_size)
+    token_start = HEADER_SIZE + room_name_size
+    message_start = token_start + token_size
+    packet[HEADER_SIZE:token_start] = room_name_bytes
+    packet[token_start:message_start] = token_bytes
+    packet[message_start:] = message_bytes
 
-    # Combine header + body
-    packet = header + room_name_bytes + token_bytes + message_bytes
-
-    return packet
+    return bytes(packet)
 
 
 def decode_udp_message(packet: bytes) -> UDPChatMessage:
@@ -105,7 +115,7 @@ def decode_udp_message(packet: bytes) -> UDPChatMessage:
         raise ValueError(f"Packet too small: {len(packet)} < {HEADER_SIZE}")
 
     # Unpack header: RoomNameSize(1) + TokenSize(1)
-    room_name_size, token_size = struct.unpack("BB", packet[:HEADER_SIZE])
+    room_name_size, token_size = _CLIENT_HEADER.unpack_from(packet)
 
     # Validate header values
     if room_name_size > MAX_ROOM_NAME_SIZE:
@@ -118,23 +128,17 @@ def decode_udp_message(packet: bytes) -> UDPChatMessage:
     if len(packet) < expected_size:
         raise ValueError(f"Packet incomplete: {len(packet)} < {expected_size}")
 
-    # Extract body parts
-    offset = HEADER_SIZE
-    room_name_bytes = packet[offset : offset + room_name_size]
-    offset += room_name_size
-
-    token_bytes = packet[offset : offset + token_size]
-    offset += token_size
-
-    message_bytes = packet[offset:]
-
-    # Decode UTF-8 strings
+    # Decode body parts straight from views of the packet, without slicing copies
+    view = memoryview(packet)
+    token_start = HEADER_SIZE + room_name_size
+    message_start = token_start + token_size
     try:
-        room_name_string = room_name_bytes.decode("utf-8")
-        token_string = token_bytes.decode("utf-8")
-        message_string = message_bytes.decode("utf-8")
+        room_name_string = str(view[HEADER_SIZE:token_start], "utf-8")
+        # Issued tokens are hex: ASCII is the cheapest decode and rejects anything else
+        token_string = str(view[token_start:message_start], "ascii")
+        message_string = str(view[message_start:], "utf-8")
     except UnicodeDecodeError as e:
-        raise ValueError(f"Invalid UTF-8 encoding: {e}")
+        raise ValueError(f"Invalid encoding: {e}")
 
     return UDPChatMessage(room_name_string, token_string, message_string)
 
@@ -164,25 +168,34 @@ def encode_server_message(msg_type: int, username: str, message: str) -> bytes:
     Returns:
         Encoded UDP packet bytes (max 4094 bytes)
     """
-    username_bytes = username.encode("utf-8")
-    message_bytes = message.encode("utf-8")
+    return encode_server_message_bytes(
+        msg_type, username.encode("utf-8"), message.encode("utf-8")
+    )
 
-    # Validate sizes
-    if len(username_bytes) > 255:
-        raise ValueError(f"Username too long: {len(username_bytes)} > 255")
-    if len(message_bytes) > 255:
-        raise ValueError(f"Message too long: {len(message_bytes)} > 255")
 
-    total_size = 3 + len(username_bytes) + len(message_bytes)
-    if total_size > MAX_PACKET_SIZE_SERVER_TO_CLIENT:
-        raise ValueError(
-            f"Packet too large: {total_size} > {MAX_PACKET_SIZE_SERVER_TO_CLIENT}"
-        )
+def encode_server_message_bytes(
+    msg_type: int, username_bytes: bytes, message_bytes: bytes
+) -> bytes:
+    """Encode a server-to-client UDP message from already UTF-8 encoded fields"""
+    username_size = len(username_bytes)
+    message_size = len(message_bytes)
+
+    # Validate sizes with one test; two one-byte fields always fit in a packet
+    if (username_size | message_size) > 0xFF:
+        if username_size > 0xFF:
+            raise ValueError(f"Username too long: {username_size} > 255")
+        raise ValueError(f"Message too long: {message_size} > 255")
 
-    # Packet header: MessageType(1) + UsernameSize(1) + MessageSize(1)
-    header = struct.pack("BBB", msg_type, len(username_bytes), len(message_bytes))
+    total_size = SERVER_HEADER_SIZE + username_size + message_size
 
-    return header + username_bytes + message_bytes
+    # Build header + body in one buffer
+    packet = bytearray(total_size)
+    _SERVER_HEADER.pack_into(packet, 0, msg_type, username_size, message_size)
+    message_start = SERVER_HEADER_SIZE + username_size
+    packet[SERVER_HEADER_SIZE:message_start] = username_bytes
+    packet[message_start:] = message_bytes
+
+    return bytes(packet)
 
 
 def decode_server_message(packet: bytes) -> UDPServerMessage:
@@ -192,18 +205,18 @@ def decode_server_message(packet: bytes) -> UDPServerMessage:
     returns:
         UDPServerMessage object
     """
-    if len(packet) < 3:
-        raise ValueError(f"Packet too small: {len(packet)} < 3")
+    if len(packet) < SERVER_HEADER_SIZE:
+        raise ValueError(f"Packet too small: {len(packet)} < {SERVER_HEADER_SIZE}")
 
-    msg_type, username_size, message_size = struct.unpack("BBB", packet[:3])
+    msg_type, username_size, message_size = _SERVER_HEADER.unpack_from(packet)
 
     if len(packet) < 3 + username_size + message_size:
         raise ValueError("Packet incomplete")
 
-    username_string = packet[3 : 3 + username_size].decode("utf-8")
-    message_string = packet[
-        3 + username_size : 3 + username_size + message_size
-    ].decode("utf-8")
+    view = memoryview(packet)
+    message_start = SERVER_HEADER_SIZE + username_size
+    username_string = str(view[SERVER_HEADER_SIZE:message_start], "utf-8")
+    message_string = str(view[message_start : message_start + message_size], "utf-8")
 
     return UDPServerMessage(msg_type, username_string, message_string)
 
@@ -243,20 +256,31 @@ def test_upd_protocol():
             assert encoded.msg_type == msg_type
             assert encoded.username == username
             assert encoded.message == message
+            assert packet == encode_server_message_bytes(
+                msg_type, username.encode("utf-8"), message.encode("utf-8")
+            )
         print("✅ Test 2: Server message types passed")
     except Exception as e:
         print(f"❌ Test 2 failed: {e}")
 
     # Test 3: Unicode support
     try:
-        packet = encode_udp_message("部屋", "トークン", "こんにちは！🎉")
+        packet = encode_udp_message("部屋", "0a1b2c9f", "こんにちは！🎉")
         decoded = decode_udp_message(packet)
 
         assert decoded.room_name == "部屋"
+        assert decoded.token == "0a1b2c9f"
         assert decoded.message == "こんにちは！🎉"
-        print("✅ Test 3: Unicode support passed")
+        print("✅ Test 3a: Unicode support passed")
     except Exception as e:
-        print(f"❌ Test 3 failed: {e}")
+        print(f"❌ Test 3a failed: {e}")
+
+    try:
+        # Tokens are hex: anything else is rejected rather than mis-decoded
+        decode_udp_message(encode_udp_message("部屋", "トークン", "msg"))
+        print("❌ Test 3b: Should have failed on a non-ASCII token")
+    except ValueError:
+        print("✅ Test 3b: Non-ASCII token rejection passed")
 
     # Test 4: Error handling
     try:
@@ -4,23 +4,35 @@ UDP Server for Stage 2 Chat Room Messaging
 Handles real-time chat within rooms created via TCP
 """
 
+import logging
+import os
+import queue
 import socket
 import threading
 import time
-from typing import Dict, Optional, Set
+from typing import Dict, Optional, Set, Tuple
 
+from mmsg import DatagramBatcher, DatagramReceiver, pack_sockaddr_in
 from room_manager import Room
 from tcp_protocol import TokenManager
 from udp_protocol import (
+    MAX_PACKET_SIZE_CLIENT_TO_SERVER,
     MSG_TYPE_CHAT,
     MSG_TYPE_SYSTEM,
     MSG_TYPE_USER_JOIN,
     MSG_TYPE_USER_LEAVE,
     decode_udp_message,
-    encode_server_message,
+    encode_server_message_bytes,
     encode_udp_message,
 )
 
+log = logging.getLogger(__name__)
+
+UDP_WORKERS = os.cpu_count() or 1  # Threads handling received datagrams
+MAX_BACKLOG = 256  # Queued datagrams beyond this are dropped
+VALIDATION_TTL_SECONDS = 1.0  # How long a successful client validation is reused
+MAX_VALIDATION_CACHE = 4096  # Entries kept before the cache is started afresh
+
 
 class UDPChatServer:
     """UDP server for room-based chat messaging"""
@@ -30,42 +42,79 @@ class UDPChatServer:
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP socket
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.batcher = DatagramBatcher(self.sock)  # One sendmmsg per broadcast
+        self._send_lock = threading.Lock()  # The batcher's arrays are shared
 
         # Shared state (will be injected unified server)
         self.rooms: Dict[str, Room] = {}
         self.token_manager = TokenManager()
-
-        # New: Client address tracking for UDP broadcasting
-        self.client_addresses: Dict[str, tuple] = {}  # {token: (ip, port)}
         self.running = False
 
+        # The recv loop only queues datagrams; a fixed pool of workers handles them
+        self._inbox = queue.SimpleQueue()
+        self._workers = []
+        self._backlog = threading.BoundedSemaphore(MAX_BACKLOG)  # One per queued
+        self.dropped = 0  # Datagrams dropped while the workers were behind
+
+        # {(token, room_name, ip): (room, username, username_bytes, expires_at)}
+        self._valid_cache: Dict[Tuple[str, str, str], tuple] = {}
+
         print(f"\n🟢 UDP Chat Server initialized on {self.host}:{self.port}")
 
     def start(self):
         """Start the UDP server"""
         try:
             self.sock.bind((self.host, self.port))
+            self.port = self.sock.getsockname()[1]
             self.running = True
             print(f"🚀 UDP Chat Server listening on {self.host}:{self.port}")
 
-            while self.running:
-                try:
-                    data, client_addr = self.sock.recvfrom(4096)
-
-                    # Process each message in a separate thread
-                    threading.Thread(
-                        target=self._handle_message,
-                        args=(data, client_addr),
-                        daemon=True,
-                    ).start()
-                except socket.error as e:
-                    if self.running:
-                        print(f"🔴 UDP socket error: {e}")
+            for _ in range(UDP_WORKERS):
+                worker = threading.Thread(target=self._worker_loop, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+            self._recv_loop()
         except Exception as e:
             print(f"🔴 UDP server error: {e}")
         finally:
             self.stop()
 
+    def _recv_loop(self):
+        """Receive datagrams and queue them for the workers"""
+        # Drain a burst per recvmmsg call into reused buffers; workers get copies
+        receiver = DatagramReceiver(self.sock, MAX_PACKET_SIZE_CLIENT_TO_SERVER)
+        recv, put = receiver.recv, self._inbox.put  # Per-packet calls
+        reserve = self._backlog.acquire
+        dropped = 0  # Counted locally and published: self.dropped has one writer
+        while self.running:
+            try:
+                for data, client_addr in recv():
+                    # UDP is lossy anyway: under a flood, drop rather than queue
+                    if not reserve(blocking=False):
+                        dropped += 1
+                        self.dropped = dropped
+                        continue
+
+                    # Hand the message to the next free worker
+                    put((bytes(data), client_addr))
+            except socket.error as e:
+                if self.running:
+                    print(f"🔴 UDP socket error: {e}")
+
+    def _worker_loop(self):
+        """Handle queued messages until a None sentinel arrives"""
+        get, handle = self._inbox.get, self._handle_message  # Per-packet calls
+        release = self._backlog.release
+        while True:
+            item = get()
+            if item is None:
+                break
+            try:
+                handle(*item)
+            finally:
+                release()
+
     def set_shared_state(self, rooms: Dict[str, Room], token_manager: TokenManager):
         """Inject shared state from TCP server"""
         self.rooms = rooms
@@ -77,116 +126,160 @@ class UDPChatServer:
         try:
             # Decode the UDP message
             udp_msg = decode_udp_message(data)
-            print(
-                f"\n📨 UDP message from {client_addr}: room='{udp_msg.room_name}' msg='{udp_msg.message[:50]}...'"
+            log.debug(
+                "📨 UDP message from %s: room='%s' msg='%.50s...'",
+                client_addr,
+                udp_msg.room_name,
+                udp_msg.message,
             )
 
-            # Validate token and get user info
-            user_info = self._validate_client(
+            # Validate token and get the sender's room and username
+            sender = self._validate_client(
                 udp_msg.token, udp_msg.room_name, client_addr[0]
             )
-            if not user_info:
+            if sender is None:
                 return  # Invalid client, ignore message
-
-            username = user_info["username"]
+            room, username, username_bytes = sender
 
             # New: Update client address mapping for broadcasting
-            self._update_client_address(udp_msg.token, client_addr)
+            self._update_client_address(room, udp_msg.token, client_addr)
 
             # Broadcast message to all room participants
             self._broadcast_to_room(
-                udp_msg.room_name, MSG_TYPE_CHAT, username, udp_msg.message
+                udp_msg.room_name,
+                MSG_TYPE_CHAT,
+                username,
+                udp_msg.message,
+                username_bytes,
             )
 
         except Exception as e:
             print(f"🔴 Error handling UDP message from {client_addr}: {e}")
 
-    def _update_client_address(self, token: str, client_addr: tuple):
+    def _update_client_address(self, room: Room, token: str, client_addr: tuple):
         """
         Update client address mapping for broadcasting
 
         Args:
+            room: room the token belongs to
             token: client's authentication token
             client_addr: (ip, port) tuple from UDP packet
         """
-        previous_addr = self.client_addresses.get(token)
-        self.client_addresses[token] = client_addr
-
-        if previous_addr != client_addr:
-            print(
-                f"🔄 Updated address for token {token[:8]}...: {previous_addr} -> {client_addr}"
+        entry = room.addresses.get(token)
+        if entry is None or entry[0] != client_addr:
+            # Pack the sockaddr once per address change, not once per broadcast
+            previous_addr = room.set_address(
+                token, client_addr, pack_sockaddr_in(client_addr)
+            )
+            log.debug(
+                "🔄 Updated address for token %.8s...: %s -> %s",
+                token,
+                previous_addr,
+                client_addr,
             )
 
     def _broadcast_to_room(
-        self, room_name: str, msg_type: int, sender_username: str, message: str
+        self,
+        room_name: str,
+        msg_type: int,
+        sender_username: str,
+        message: str,
+        sender_username_bytes: Optional[bytes] = None,
     ):
         """
         Broadcast message to all participants in the room
 
+        sender_username_bytes, when given, is sender_username already encoded
+
         Error Specifications:
         - Room not found: Skip broadcast if room no longer exists
         - Socket errors: Log failed sends but continue with others
         - Encoding errors: Skip malformed messages
         """
         try:
-            if room_name not in self.rooms:
+            room = self.rooms.get(room_name)
+            if room is None:
                 print(f"❌ Cannot broadcast: room '{room_name}' not found")
                 return
 
-            room = self.rooms[room_name]
-            participant_count = len(room.participants)
+            roster = room.roster  # Immutable snapshot (copy-on-write)
+            participant_count = len(roster.tokens)
 
             if participant_count == 0:
-                print(f"📭 No participants in room '{room_name}' to broadcast to")
+                log.debug("📭 No participants in room '%s' to broadcast to", room_name)
                 return
 
             # Create server message
-            server_msg = encode_server_message(msg_type, sender_username, message)
-            successful_sends = 0
-
-            # Send to all room participants who have known UDP addresses
-            for token, participant in room.participants.items():
-                try:
-                    # Check if we have this client's UDP address
-                    if token not in self.client_addresses:
-                        print(
-                            f"⚠️ No UDP address known for {participant['username']} (token {token[:8]}...)"
-                        )
-                        continue
-
-                    client_addr = self.client_addresses[token]
-
-                    # Send UDP message to client
-                    self.sock.sendto(server_msg, client_addr)
-                    print(
-                        f"\n📤 Broadcasting to {participant['username']} at {client_addr}"
-                    )
-                    successful_sends += 1
+            if sender_username_bytes is None:
+                sender_username_bytes = sender_username.encode("utf-8")
+            server_msg = encode_server_message_bytes(
+                msg_type, sender_username_bytes, message.encode("utf-8")
+            )
 
-                except Exception as send_error:
-                    print(
-                        f"❌ Failed to send to {participant.get('username', 'unknown')}: {send_error}"
-                    )
+            # Participants with known UDP addresses, kept up to date by the room
+            targets, names = room.targets
+            if len(targets) < participant_count and log.isEnabledFor(logging.DEBUG):
+                addresses = room.addresses
+                for token, username in zip(roster.tokens, roster.usernames):
+                    if token not in addresses:
+                        log.debug(
+                            "⚠️ No UDP address known for %s (token %.8s...)",
+                            username,
+                            token,
+                        )
 
-            print(
-                f"\n📡 Broadcast complete: {successful_sends}/{participant_count} delivered to room '{room_name}'"
+            # Send to all of them in one batch
+            with self._send_lock:
+                failed = self.batcher.send(server_msg, targets, names)
+            if failed:
+                # Name the recipients only when something went wrong
+                addresses = room.addresses
+                usernames = {
+                    addresses[token][0]: username
+                    for token, username in zip(roster.tokens, roster.usernames)
+                    if token in addresses
+                }
+                for client_addr, send_error in failed:
+                    username = usernames.get(client_addr, "unknown")
+                    print(f"❌ Failed to send to {username}: {send_error}")
+            successful_sends = len(targets) - len(failed)
+
+            log.debug(
+                "📡 Broadcast complete: %d/%d delivered to room '%s'",
+                successful_sends,
+                participant_count,
+                room_name,
             )
         except Exception as e:
             print(f"🔴 Broadcast error for room '{room_name}': {e}")
 
     def _validate_client(
         self, token: str, room_name: str, client_ip: str
-    ) -> Optional[Dict]:
+    ) -> Optional[Tuple[Room, str, bytes]]:
         """
         Validate client token, room access, and IP binding
 
-        Returns user info dict if valid, None if invalid
+        Returns (room, username, username_bytes) if valid, None if invalid
         Error Specifications:
         - Invalid token: Token not found or expired
         - Room not found: Requested room does not exist or expired
         - IP mismatch: Client IP does not match token registration
         - Not room participant: User not in the requested room
         """
+        # A client sending a burst is only fully checked once per TTL; a hit still
+        # confirms the token, room and membership are live (cheap dict lookups)
+        key = (token, room_name, client_ip)
+        now = time.monotonic()
+        cached = self._valid_cache.get(key)
+        if cached is not None and cached[3] > now:
+            room = cached[0]
+            if (
+                self.rooms.get(room_name) is room
+                and token in room.roster.index
+                and token in self.token_manager.tokens
+            ):
+                return cached[:3]
+
         try:
             # 1. Validate token exists and is active
             if not self.token_manager or not self.token_manager.validate_token(
@@ -196,28 +289,36 @@ class UDPChatServer:
                 return None
 
             # 2. Check if room exists
-            if room_name not in self.rooms:
+            room = self.rooms.get(room_name)
+            if room is None:
                 print(f"❌ Room '{room_name}' not found for token {token[:8]}...")
                 return None
 
-            room = self.rooms[room_name]
-
             # 3. Verify user is a participant in this room
-            if token not in room.participants:
+            roster = room.roster
+            i = roster.index.get(token)
+            if i is None:
                 print(f"❌ Token {token[:8]}... not authorized for room '{room_name}'")
                 return None
 
-            user_info = room.participants[token]
-
             # 4. Validate IP address binding (security requirement)
-            if user_info["ip"] != client_ip:
+            if roster.ips[i] != client_ip:
                 print(
-                    f"❌ IP mismatch for token {token[:8]}...: expected {user_info['ip']} but got {client_ip}"
+                    f"❌ IP mismatch for token {token[:8]}...: "
+                    f"expected {roster.ips[i]} but got {client_ip}"
                 )
                 return None
 
-            print(f"\n✅ Validated user {user_info['username']} in room '{room_name}'")
-            return user_info
+            username = roster.usernames[i]
+            username_bytes = roster.username_bytes[i]
+            log.debug("✅ Validated user %s in room '%s'", username, room_name)
+
+            # Swapping in a new dict keeps this safe for concurrent workers
+            if len(self._valid_cache) >= MAX_VALIDATION_CACHE:
+                self._valid_cache = {}
+            expires_at = now + VALIDATION_TTL_SECONDS
+            self._valid_cache[key] = (room, username, username_bytes, expires_at)
+            return room, username, username_bytes
 
         except Exception as e:
             print(f"❌ Validation error: {e}")
@@ -228,6 +329,11 @@ class UDPChatServer:
         self.running = False
         if self.sock:
             self.sock.close()
+
+        # One sentinel per worker; stop() may run twice, so clear the list
+        workers, self._workers = self._workers, []
+        for _ in workers:
+            self._inbox.put(None)
         print("\n🛑 UDP Chat Server stopped")
 
 
@@ -50,6 +50,7 @@ class Stage2ChatServer:
         self.tcp_thread = None
         self.udp_thread = None
         self.running = False
+        self._stop_event = threading.Event()  # Wakes the monitor on shutdown
 
         print("\n✅ Server components initialized")
 
@@ -115,6 +116,7 @@ class Stage2ChatServer:
 
     def _monitor_servers(self):
         """Monitor server health and handle shutdown"""
+        last_counts = (0, 0)
         try:
             while self.running:
                 # Check if both servers are still running
@@ -131,12 +133,14 @@ class Stage2ChatServer:
                     len(self.token_manager.tokens) if self.token_manager else 0
                 )
 
-                if room_count > 0 or token_count > 0:
+                # Only report when something changed since the last poll
+                if (room_count, token_count) != last_counts:
+                    last_counts = (room_count, token_count)
                     print(
                         f"\n📊 Status: {room_count} active rooms, {token_count} active tokens"
                     )
 
-                time.sleep(5)  # Status update every 5 seconds
+                self._stop_event.wait(5)  # Status check every 5 seconds
 
         except KeyboardInterrupt:
             print("\n🛑 Shutdown signal received...")
@@ -152,6 +156,7 @@ class Stage2ChatServer:
 
         print("\n🛑 Stopping Unified Stage 2 Chat Server...")
         self.running = False
+        self._stop_event.set()
 
         # Stop both servers
         if self.tcp_server:
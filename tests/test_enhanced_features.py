@@ -5,6 +5,7 @@ Tests the new join functionality, disconnect notifications, and server status fe
 """
 
 import os
+import struct
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -27,32 +28,35 @@ def print_test_header(test_name):
     print(f"{'=' * 70}")
 
 
+def _expected_packet(msg_type: int, username: str, message: str) -> bytes:
+    """Build a packet straight from the wire format, independent of the encoder"""
+    username_bytes = username.encode("utf-8")
+    return struct.pack(
+        f"!BB{len(username_bytes)}s", msg_type, len(username_bytes), username_bytes
+    ) + message.encode("utf-8")
+
+
 def test_protocol_enhancements():
     """Test the enhanced protocol with message types"""
     print_test_header("PROTOCOL ENHANCEMENT TESTS")
 
     print("1️⃣  Testing Join Request Encoding/Decoding")
     join_data = encode_join_request("Alice")
-    username, message, msg_type = decode_message(join_data)
-    assert username == "Alice"
-    assert message == "join"
-    assert msg_type == MSG_TYPE_JOIN
+    assert join_data == _expected_packet(MSG_TYPE_JOIN, "Alice", "join")
+    # One round-trip as a sanity check on the decoder
+    assert decode_message(join_data) == ("Alice", "join", MSG_TYPE_JOIN)
     print("✅ Join request protocol works correctly")
 
     print("\n2️⃣  Testing System Message Encoding/Decoding")
     system_data = encode_system_message("Server is shutting down")
-    username, message, msg_type = decode_message(system_data)
-    assert username == "SYSTEM"
-    assert message == "Server is shutting down"
-    assert msg_type == MSG_TYPE_SYSTEM
+    assert system_data == _expected_packet(
+        MSG_TYPE_SYSTEM, "SYSTEM", "Server is shutting down"
+    )
     print("✅ System message protocol works correctly")
 
     print("\n3️⃣  Testing Chat Message with Type")
     chat_data = encode_message("Bob", "Hello World", MSG_TYPE_CHAT)
-    username, message, msg_type = decode_message(chat_data)
-    assert username == "Bob"
-    assert message == "Hello World"
-    assert msg_type == MSG_TYPE_CHAT
+    assert chat_data == _expected_packet(MSG_TYPE_CHAT, "Bob", "Hello World")
     print("✅ Chat message with type works correctly")
 
 
@@ -131,19 +135,18 @@ This simulates multiple users joining and chatting rapidly.
 import socket
 import time
 from stage1.protocol import encode_join_request, encode_message, MSG_TYPE_CHAT
+from stage1.mmsg import send_all
 
 # Simulate 5 users joining
+# Each user needs its own socket: the server tells clients apart by address
 for i in range(5):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     username = f"User{i}"
     
-    # Send join request
+    # Send join request and a chat message: two datagrams, one sendmmsg call
     join_data = encode_join_request(username)
-    sock.sendto(join_data, ('localhost', 12345))
-    
-    # Send a chat message
     chat_data = encode_message(username, f"Hello from {username}!", MSG_TYPE_CHAT)
-    sock.sendto(chat_data, ('localhost', 12345))
+    send_all(sock, [join_data, chat_data], ('127.0.0.1', 12345))
     
     time.sleep(0.1)  # Small delay
     sock.close()
@@ -8,10 +8,17 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import ctypes
+import errno
+import itertools
+import selectors
 import socket
 import threading
 import time
 import unittest
+from unittest import mock
+
+from stage1 import mmsg
 
 from stage1.client import ChatClient
 from stage1.protocol import (
@@ -19,11 +26,31 @@ from stage1.protocol import (
     MSG_TYPE_CHAT,
     MSG_TYPE_SYSTEM,
     decode_message,
+    encode_disconnect_request,
     encode_join_request,
     encode_message,
 )
 from stage1.server import ChatServer
 
+SOCKET_BUFFER_SIZE = 12 * 1024 * 1024  # Linux caps this at net.core.[rw]mem_max
+
+
+def _tune(sock: socket.socket) -> socket.socket:
+    """Enlarge a test socket's kernel buffers so bursts aren't dropped"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    return sock
+
+
+def wait_for(predicate, timeout: float = 1.0) -> bool:
+    """Poll predicate until it is true or timeout seconds have passed"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
 
 class TestIntegration(unittest.TestCase):
     def setUp(self):
@@ -35,12 +62,12 @@ class TestIntegration(unittest.TestCase):
         self.server_thread = threading.Thread(target=self.server.start)
         self.server_thread.daemon = True
         self.server_thread.start()
-        time.sleep(0.1)  # Give server time to start
+        self.assertTrue(wait_for(lambda: self.server.running))
 
     def tearDown(self):
         """Clean up after tests"""
         self.server.stop()
-        time.sleep(0.1)
+        self.server_thread.join(timeout=1.0)
 
     # def test_single_client_connection(self):
     #     """Test single client can connect and send messages"""
@@ -59,7 +86,7 @@ class TestIntegration(unittest.TestCase):
     #         # Check if server registered client
     #         self.assertEqual(len(self.server.clients), 1)
     #         # Check if server received message
-    #         client_addr = list(self.server.clients.keys())[0]
+    #         client_addr = next(iter(self.server.clients))
     #         self.assertEqual(self.server.joined_clients[client_addr], "TestUser")
 
     #         # end_time = time.time()
@@ -70,38 +97,32 @@ class TestIntegration(unittest.TestCase):
 
     def test_multiple_client_broadcast(self):
         """Test message broadcasting between multiple clients"""
-        client1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client1 = _tune(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+        client2 = _tune(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
 
         try:
+            # Resolve the server once; each send then reuses the peer address
+            client1.connect(("localhost", self.server_port))
+            client2.connect(("localhost", self.server_port))
+
             # Both clients send join requests
             join_data1 = encode_join_request("Alice")
-            client1.sendto(join_data1, ("localhost", self.server_port))
-            time.sleep(0.1)
+            client1.send(join_data1)
+            self.assertTrue(wait_for(lambda: len(self.server.joined_clients) == 1))
             join_data2 = encode_join_request("Bob")
-            client2.sendto(join_data2, ("localhost", self.server_port))
-            time.sleep(0.1)
+            client2.send(join_data2)
+            self.assertTrue(wait_for(lambda: len(self.server.joined_clients) == 2))
 
             # Both clients send initial messages to register
-            client1.sendto(
-                encode_message("Alice", "Hello from Alice"),
-                ("localhost", self.server_port),
-            )
-            time.sleep(0.1)
-            client2.sendto(
-                encode_message("Bob", "Hello from Bob"),
-                ("localhost", self.server_port),
-            )
+            client1.send(encode_message("Alice", "Hello from Alice"))
+            client2.send(encode_message("Bob", "Hello from Bob"))
 
             # Check if both clients received messages
-            time.sleep(0.1)
             self.assertEqual(len(self.server.clients), 2)
-            self.assertEqual(
-                self.server.joined_clients[list(self.server.clients.keys())[0]], "Alice"
-            )
-            self.assertEqual(
-                self.server.joined_clients[list(self.server.clients.keys())[1]], "Bob"
-            )
+            first_addr = next(iter(self.server.clients))
+            second_addr = next(itertools.islice(self.server.clients, 1, 2))
+            self.assertEqual(self.server.joined_clients[first_addr], "Alice")
+            self.assertEqual(self.server.joined_clients[second_addr], "Bob")
 
             # Client1 sends a message
             # client1.sendto(
@@ -109,20 +130,92 @@ class TestIntegration(unittest.TestCase):
             #     ("localhost", self.server_port),
             # )
 
-            # Thread is not running, client2 will only receive join message of himself
-            client2.settimeout(0.5)
-            data, _ = client2.recvfrom(MAX_MESSAGE_SIZE)
-            username, message, msg_type = decode_message(data)
-            print(username, message, msg_type)
-
-            self.assertEqual(username, "SYSTEM")
-            self.assertEqual(message, "🎉 Bob has joined the chat")
-            self.assertEqual(msg_type, MSG_TYPE_SYSTEM)
+            # Drain whichever client is ready until each has received something
+            received = {client1: [], client2: []}
+            with selectors.DefaultSelector() as sel:
+                for client in received:
+                    sel.register(client, selectors.EVENT_READ)
+                while not all(received.values()):
+                    events = sel.select(timeout=0.5)
+                    if not events:
+                        break
+                    for key, _ in events:
+                        data, _ = key.fileobj.recvfrom(MAX_MESSAGE_SIZE)
+                        received[key.fileobj].append(decode_message(data))
+
+            # Each client first hears its own join notice
+            self.assertEqual(
+                received[client1][:1],
+                [("SYSTEM", "🎉 Alice has joined the chat", MSG_TYPE_SYSTEM)],
+            )
+            self.assertEqual(
+                received[client2][:1],
+                [("SYSTEM", "🎉 Bob has joined the chat", MSG_TYPE_SYSTEM)],
+            )
 
         finally:
             client1.close()
             client2.close()
 
+    def test_rejoin_keeps_one_deadline_entry(self):
+        """Test disconnect/rejoin cycles from one address don't grow the timeout heap"""
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        try:
+            client.connect(("localhost", self.server_port))
+            for _ in range(3):
+                client.send(encode_join_request("Alice"))
+                self.assertTrue(wait_for(lambda: len(self.server.joined_clients) == 1))
+                client.send(encode_disconnect_request("Alice"))
+                self.assertTrue(wait_for(lambda: not self.server.clients))
+
+            client.send(encode_join_request("Alice"))
+            self.assertTrue(wait_for(lambda: len(self.server.joined_clients) == 1))
+            self.assertEqual(len(self.server._deadlines), 1)
+        finally:
+            client.close()
+
+    @unittest.skipUnless(mmsg.HAVE_SENDMMSG, "needs sendmmsg")
+    def test_full_send_buffer_drops_no_client(self):
+        """Test broadcasts hitting a full SO_SNDBUF don't disconnect clients"""
+        real_sendmmsg = mmsg._sendmmsg
+        calls = itertools.count()
+
+        def sometimes_full(fd, msgs, vlen, flags):
+            # Loopback never fills the buffer, so answer EAGAIN as a full one would
+            if next(calls) % 2 == 0:
+                ctypes.set_errno(errno.EAGAIN)
+                return -1
+            return real_sendmmsg(fd, msgs, vlen, flags)
+
+        clients = [
+            _tune(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) for _ in range(2)
+        ]
+        try:
+            with mock.patch.object(mmsg, "_sendmmsg", sometimes_full):
+                for client, username in zip(clients, ("Alice", "Bob")):
+                    client.connect(("localhost", self.server_port))
+                    client.send(encode_join_request(username))
+                self.assertTrue(wait_for(lambda: len(self.server.joined_clients) == 2))
+
+                for i in range(50):
+                    clients[0].send(encode_message("Alice", f"burst {i}"))
+                # Every chat still reaches Bob, after his own join notice
+                clients[1].settimeout(1.0)
+                chats = []
+                while len(chats) < 50:
+                    username, message, _ = decode_message(
+                        clients[1].recv(MAX_MESSAGE_SIZE)
+                    )
+                    if username == "Alice":
+                        chats.append(message)
+
+            self.assertEqual(chats, [f"burst {i}" for i in range(50)])
+            self.assertEqual(len(self.server.joined_clients), 2)
+        finally:
+            for client in clients:
+                client.close()
+
 
 if __name__ == "__main__":
     unittest.main()
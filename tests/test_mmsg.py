@@ -0,0 +1,221 @@
+# tests/test_mmsg.py - Unit tests for batched datagram I/O
+"""
+Test suite for Stage 1 sendmmsg/recvmmsg helpers
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ctypes
+import errno
+import socket
+import time
+import unittest
+from unittest import mock
+
+from stage1 import mmsg
+from stage1.mmsg import (
+    HAVE_RECVMMSG,
+    HAVE_SENDMMSG,
+    DatagramBatcher,
+    DatagramReceiver,
+    SockaddrTable,
+    pack_sockaddr_in,
+    send_all,
+    unpack_sockaddr_in,
+)
+
+
+class TestDatagramBatcher(unittest.TestCase):
+    def setUp(self):
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receivers = []
+        for _ in range(5):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            sock.settimeout(0.5)
+            self.receivers.append(sock)
+
+    def tearDown(self):
+        self.sender.close()
+        for sock in self.receivers:
+            sock.close()
+
+    def test_pack_sockaddr_in(self):
+        """Test sockaddr_in packing keeps port in network byte order"""
+        packed = pack_sockaddr_in(("127.0.0.1", 0x1234))
+        self.assertEqual(len(packed), 16)
+        self.assertEqual(packed[2:8], b"\x12\x34\x7f\x00\x00\x01")
+
+    def test_broadcast_reaches_every_peer(self):
+        """Test one payload is delivered to every destination"""
+        # Capacity smaller than the peer count forces the arrays to grow
+        batcher = DatagramBatcher(self.sender, capacity=2)
+        payload = b"\x02\x06SYSTEM hello\x00world"
+
+        failed = batcher.send(payload, [s.getsockname() for s in self.receivers])
+
+        self.assertEqual(failed, [])
+        for sock in self.receivers:
+            data, _ = sock.recvfrom(4096)
+            self.assertEqual(data, payload)
+
+    def test_broadcast_with_packed_names(self):
+        """Test pre-packed sockaddrs are used as given"""
+        batcher = DatagramBatcher(self.sender)
+        addrs = [s.getsockname() for s in self.receivers]
+        packed = b"".join(pack_sockaddr_in(addr) for addr in addrs)
+
+        self.assertEqual(batcher.send(b"packed", addrs, packed), [])
+        for sock in self.receivers:
+            self.assertEqual(sock.recvfrom(4096)[0], b"packed")
+
+    def test_broadcast_from_buffer_view(self):
+        """Test a view into a receive buffer can be relayed without copying"""
+        batcher = DatagramBatcher(self.sender)
+        buffer = bytearray(b"\x02\x05Alicehi there\x00\x00\x00")
+
+        failed = batcher.send(memoryview(buffer)[:15], [self.receivers[0].getsockname()])
+
+        self.assertEqual(failed, [])
+        data, _ = self.receivers[0].recvfrom(4096)
+        self.assertEqual(data, b"\x02\x05Alicehi there")
+
+    @unittest.skipUnless(HAVE_SENDMMSG, "needs sendmmsg")
+    def test_full_send_buffer_is_retried_not_reported(self):
+        """Test EAGAIN from a full send buffer is waited out, not blamed on peers"""
+        real_sendmmsg = mmsg._sendmmsg
+        calls = []
+
+        def full_then_real(fd, msgs, vlen, flags):
+            calls.append(vlen)
+            if len(calls) == 1:  # The kernel's answer when SO_SNDBUF is full
+                ctypes.set_errno(errno.EAGAIN)
+                return -1
+            return real_sendmmsg(fd, msgs, vlen, flags)
+
+        self.sender.setblocking(False)
+        batcher = DatagramBatcher(self.sender)
+        with mock.patch.object(mmsg, "_sendmmsg", full_then_real):
+            failed = batcher.send(b"later", [s.getsockname() for s in self.receivers])
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len(calls), 2)
+        for sock in self.receivers:
+            self.assertEqual(sock.recvfrom(4096)[0], b"later")
+
+    def test_send_on_closed_socket_reports_failures(self):
+        """Test every destination is reported when the socket is gone"""
+        batcher = DatagramBatcher(self.sender)
+        self.sender.close()
+
+        addrs = [s.getsockname() for s in self.receivers[:2]]
+        failed = batcher.send(b"lost", addrs)
+
+        self.assertEqual([addr for addr, _ in failed], addrs)
+
+
+class TestSockaddrTable(unittest.TestCase):
+    def test_snapshot_tracks_adds_and_removes(self):
+        """Test addresses and packed sockaddrs stay aligned after swap-removal"""
+        table = SockaddrTable()
+        addrs = [("127.0.0.1", port) for port in (5001, 5002, 5003)]
+        for addr in addrs:
+            table.add(addr)
+
+        table.remove(addrs[0])  # Last entry moves into the freed slot
+        targets, packed = table.snapshot()
+        self.assertEqual(targets, [addrs[2], addrs[1]])
+        self.assertEqual(packed, pack_sockaddr_in(addrs[2]) + pack_sockaddr_in(addrs[1]))
+
+        targets, packed = table.snapshot(exclude=addrs[2])
+        self.assertEqual(targets, [addrs[1]])
+        self.assertEqual(packed, pack_sockaddr_in(addrs[1]))
+        self.assertNotIn(addrs[0], table)
+
+
+class TestSendAll(unittest.TestCase):
+    def test_payloads_arrive_in_order(self):
+        """Test several payloads reach one destination in order"""
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(0.5)
+        try:
+            payloads = [b"first", b"second", b"third"]
+            self.assertEqual(send_all(sender, payloads, receiver.getsockname()), [])
+            for payload in payloads:
+                self.assertEqual(receiver.recvfrom(4096)[0], payload)
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_connected_socket_needs_no_address(self):
+        """Test payloads go to the connected peer when addr is omitted"""
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(0.5)
+        try:
+            sender.connect(receiver.getsockname())
+            self.assertEqual(send_all(sender, [b"one", b"two"]), [])
+            self.assertEqual(receiver.recvfrom(4096)[0], b"one")
+            self.assertEqual(receiver.recvfrom(4096)[0], b"two")
+        finally:
+            sender.close()
+            receiver.close()
+
+
+class TestDatagramReceiver(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender.bind(("127.0.0.1", 0))
+
+    def tearDown(self):
+        self.sock.close()
+        self.sender.close()
+
+    def test_unpack_sockaddr_in(self):
+        """Test sockaddr_in unpacking round-trips"""
+        addr = ("127.0.0.1", 54321)
+        self.assertEqual(unpack_sockaddr_in(pack_sockaddr_in(addr)), addr)
+
+    def test_recv_drains_queued_datagrams(self):
+        """Test queued datagrams are returned with their sender address"""
+        receiver = DatagramReceiver(self.sock, 4096, batch_size=4)
+        payloads = [f"msg{i}".encode() for i in range(3)]
+        for payload in payloads:
+            self.sender.sendto(payload, self.sock.getsockname())
+
+        received, addrs = [], []
+        while len(received) < len(payloads):
+            for data, addr in receiver.recv():
+                received.append(bytes(data))
+                addrs.append(addr)
+
+        self.assertEqual(received, payloads)
+        self.assertEqual(addrs[0], self.sender.getsockname())
+        if HAVE_RECVMMSG:
+            # Repeat senders share one interned address tuple
+            self.assertTrue(all(addr is addrs[0] for addr in addrs))
+
+    def test_fallback_drains_into_pooled_buffers(self):
+        """Test the recvfrom_into fallback returns every queued datagram"""
+        receiver = DatagramReceiver(self.sock, 4096, batch_size=4)
+        for payload in (b"one", b"two"):
+            self.sender.sendto(payload, self.sock.getsockname())
+        time.sleep(0.1)
+        self.sock.setblocking(False)
+
+        batch = receiver._recv_each()
+
+        self.assertEqual([bytes(data) for data, _ in batch], [b"one", b"two"])
+        self.assertEqual(receiver._recv_each(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
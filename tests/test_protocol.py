@@ -5,73 +5,93 @@ Test suite for Stage 1 Protocol functionality
 
 import os
 import sys
+import time
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import unittest
 
 from stage1.protocol import (
+    HEADER_SIZE,
     MAX_MESSAGE_SIZE,
     MAX_USERNAME_LENGTH,
     MSG_TYPE_CHAT,
     decode_message,
     encode_message,
+    make_chat_encoder,
 )
 
 
-class TestProtocol(unittest.TestCase):
-    def test_basic_encoding_decoding(self):
-        """Test basic message encoding and decoding"""
-        username = "Alice"
-        message = "Hello, world!"
-
-        # Encode message
-        encoded = encode_message(username, message)
-
-        # Decode message
-        decoded_username, decoded_message, decoded_msg_type = decode_message(encoded)
-
-        # Verify encoding and decoding
-        self.assertEqual(username, decoded_username)
-        self.assertEqual(message, decoded_message)
-        self.assertEqual(MSG_TYPE_CHAT, decoded_msg_type)
-
-    def test_empty_message(self):
-        """Test encoding/decoding with empty message"""
-        username = "Bob"
-        message = ""
-
-        encoded = encode_message(username, message)
-        decoded_username, decoded_message, decoded_msg_type = decode_message(encoded)
+PERF_ITERATIONS = 100_000  # Round-trips timed by the opt-in perf gate
+PERF_THRESHOLD_NS = 20_000  # Per round-trip; generous, catches gross regressions
 
-        self.assertEqual(username, decoded_username)
-        self.assertEqual(message, decoded_message)
-        self.assertEqual(decoded_msg_type, MSG_TYPE_CHAT)
+# (description, username, message) cases that must survive encode/decode unchanged
+ROUNDTRIP_CASES = [
+    ("basic", "Alice", "Hello, world!"),
+    ("empty message", "Bob", ""),
+    ("UTF-8 special characters and emojis", "Alice🚀", "Hello! 你好 🎉 こんにちは"),
+    ("near max username (250 bytes)", "A" * 250, "Test message"),
+    (
+        "max message size",
+        "Alice",
+        "A" * (MAX_MESSAGE_SIZE - len("Alice".encode("utf-8")) - 2),
+    ),
+]
 
-    def test_special_characters(self):
-        """Test UTF-8 special characters and emojis"""
-        username = "Alice🚀"
-        message = "Hello! 你好 🎉 こんにちは"
 
-        encoded = encode_message(username, message)
-        decoded_username, decoded_message, decoded_msg_type = decode_message(encoded)
-
-        self.assertEqual(username, decoded_username)
-        self.assertEqual(message, decoded_message)
-        self.assertEqual(decoded_msg_type, MSG_TYPE_CHAT)
-
-    def test_max_username_length(self):
-        """Test maximum username length (255 bytes)"""
-        # Create username close to max length
-        username = "A" * 250  # 250 ASCII characters == 250 bytes
-        message = "Test message"
-
-        encoded = encode_message(username, message)
-        decoded_username, decoded_message, decoded_msg_type = decode_message(encoded)
-
-        self.assertEqual(username, decoded_username)
-        self.assertEqual(message, decoded_message)
-        self.assertEqual(decoded_msg_type, MSG_TYPE_CHAT)
+class TestProtocol(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Build the large payloads once for every test in the class"""
+        cls.LONG_USER = "A" * 250
+        cls.BIG_MSG = "A" * (MAX_MESSAGE_SIZE - len(b"Alice") - 2)  # Fills a packet
+        cls.TOO_LONG_MSG = "A" * MAX_MESSAGE_SIZE
+        cls.ENC_BIG = encode_message("Alice", cls.BIG_MSG)
+
+    def _run_roundtrip_cases(self, cases):
+        """Encode and decode every case, reporting each failure separately"""
+        for description, username, message in cases:
+            with self.subTest(description):
+                decoded = decode_message(encode_message(username, message))
+                self.assertEqual(decoded, (username, message, MSG_TYPE_CHAT))
+
+    def test_roundtrip_cases(self):
+        """Test basic, empty, special-character and max-size round-trips"""
+        self._run_roundtrip_cases(ROUNDTRIP_CASES)
+
+    def test_encode_accepts_utf8_bytes(self):
+        """Test pre-encoded fields produce the same packets as str fields"""
+        self.assertEqual(encode_message(b"Alice", self.BIG_MSG.encode()), self.ENC_BIG)
+        self.assertEqual(
+            encode_message("Alice🚀".encode(), "你好"),
+            encode_message("Alice🚀", "你好"),
+        )
+        with self.assertRaises(ValueError):
+            encode_message(b"Alice", self.TOO_LONG_MSG.encode())
+
+    def test_wire_size_is_fixed_overhead(self):
+        """Test packets carry only the 2-byte header besides their fields"""
+        self.assertEqual(HEADER_SIZE, 2)  # msg_type + username_len, one byte each
+        self.assertEqual(len(encode_message("A", "")), HEADER_SIZE + 1)
+        self.assertEqual(
+            len(encode_message(self.LONG_USER, "Hi 👋")),
+            HEADER_SIZE + 250 + len("Hi 👋".encode()),
+        )
+
+    @unittest.skipUnless(os.environ.get("RUN_PERF"), "perf gate: set RUN_PERF=1")
+    def test_perf_encode_decode(self):
+        """Test a round-trip over the case table stays under the time budget"""
+        corpus = [(username, message) for _, username, message in ROUNDTRIP_CASES]
+        rounds = PERF_ITERATIONS // len(corpus)
+
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            for username, message in corpus:
+                decode_message(encode_message(username, message))
+        ns_per_op = (time.perf_counter_ns() - start) // (rounds * len(corpus))
+
+        print(f"\nencode+decode: {ns_per_op} ns/op")
+        self.assertLess(ns_per_op, PERF_THRESHOLD_NS)
 
     def test_username_too_long(self):
         """Test username length validation"""
@@ -82,29 +102,33 @@ class TestProtocol(unittest.TestCase):
         with self.assertRaises(ValueError):
             encode_message(username, message, MSG_TYPE_CHAT)
 
-    def test_max_message_size(self):
-        """Test message size validation"""
-        username = "Alice"
-        # Create message that approaches max size
-        max_message_len = MAX_MESSAGE_SIZE - len(username.encode("utf-8")) - 2
-        message = "A" * max_message_len
-
-        encoded = encode_message(username, message)
-        decoded_username, decoded_message, decoded_msg_type = decode_message(encoded)
-
-        self.assertEqual(username, decoded_username)
-        self.assertEqual(message, decoded_message)
-        self.assertEqual(decoded_msg_type, MSG_TYPE_CHAT)
-
     def test_message_too_long(self):
         """Test message size validation"""
         username = "Alice"
         # Create message that's too long
-        message = "A" * MAX_MESSAGE_SIZE
+        message = self.TOO_LONG_MSG
 
         with self.assertRaises(ValueError):
             encode_message(username, message)
 
+    def test_decode_from_buffer(self):
+        """Test decoding from a bytearray/memoryview receive buffer"""
+        encoded = encode_message("Alice", "Hello from a buffer")
+        buffer = bytearray(MAX_MESSAGE_SIZE)
+        buffer[: len(encoded)] = encoded
+
+        decoded = decode_message(memoryview(buffer)[: len(encoded)])
+
+        self.assertEqual(decoded, ("Alice", "Hello from a buffer", MSG_TYPE_CHAT))
+
+    def test_chat_encoder_matches_encode_message(self):
+        """Test the specialised chat encoder produces identical packets"""
+        encode_chat = make_chat_encoder("Alice")
+
+        self.assertEqual(encode_chat("Hi 👋"), encode_message("Alice", "Hi 👋"))
+        with self.assertRaises(ValueError):
+            encode_chat(self.TOO_LONG_MSG)
+
     def test_invalid_decode_data(self):
         """Test decoding invalid data"""
         # Test with empty data
@@ -9,6 +9,7 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from stage1.protocol import (
+    HEADER_SIZE,
     MSG_TYPE_PING,
     MSG_TYPE_SYSTEM,
     decode_message,
@@ -31,6 +32,16 @@ def test_ping_protocol():
     print("✅ Ping protocol works correctly")
 
 
+def test_encode_ping_wire_size():
+    """Test a ping is only the fixed header, the username and 'ping'"""
+    print("🧪 Testing Ping Wire Size")
+
+    ping_data = encode_ping_request("TestUser")
+    assert len(ping_data) == HEADER_SIZE + len("TestUser") + len("ping")
+
+    print("✅ Ping wire size is fixed")
+
+
 def print_manual_test_instructions():
     """Print detailed instructions for testing server shutdown/restart"""
     print("""
@@ -147,6 +158,7 @@ def main():
 
     print("\n1. Testing Protocol Changes...")
     test_ping_protocol()
+    test_encode_ping_wire_size()
 
     print("\n2. Manual Testing Instructions:")
     print_manual_test_instructions()